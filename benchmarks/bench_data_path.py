@@ -0,0 +1,253 @@
+"""
+Benchmark of the data path on synthetic fixtures: items/s, MB/s and peak memory per stage.
+
+Stages:
+    getitem      AudioDataset.__getitem__ over every utterance (decode + MFCC)
+    collate_fn   dataset.collate_fn over batches of precomputed items
+    contiguous_collate
+                 dataset.ContiguousCollate over the same batches; collate_fn's non-contiguous output is copied
+                 again by the first op that needs it, which the collate_fn stage does not count
+    text         TextProcess.clean_text + encode_batch over every label
+    txt_to_trans preprocess.txt_to_trans over the SRT of every talk
+    convert      preprocess.convert of every talk folder to 16 kHz wav slices
+
+Every stage runs in its own freshly spawned process, so its memory is not inflated by the other stages.
+peak_rss_mb is the peak RSS while the stage ran; stage_rss_mb is how far that is above the RSS after imports
+and setup. Results are written as JSON; pass an earlier result file to --compare to see the changes.
+Runs offline on CPU; the talk fixtures (and the convert stage) need ffmpeg.
+
+Run from the repo root:  python benchmarks/bench_data_path.py --items 200 --talks 4 --output results.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_ROOT)
+sys.path.append(os.path.join(REPO_ROOT, "scraper"))
+
+from fixtures import make_audio_dataset, make_talks
+
+STAGES = ("getitem", "collate_fn", "contiguous_collate", "text", "txt_to_trans", "convert")
+
+
+def memory_mb(field):
+    """
+    VmRSS (current) or VmHWM (peak) of this process from /proc, or the rusage high-water mark elsewhere.
+    """
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_memory():
+    """ Resets VmHWM to the current RSS (Linux >= 4.0), so the peak covers only what runs next """
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def file_mb(paths):
+    return sum(os.path.getsize(path) for path in paths) / 1e6
+
+
+def setup_getitem(fixture, args):
+    from dataset import AudioDataset
+    dataset = AudioDataset(fixture["audio_dir"], fixture["label_dir"], n_feats=args.n_feats)
+    audio_paths = [dataset.manifest.audio_path(i) for i in range(len(dataset))]
+
+    def run():
+        for i in range(len(dataset)):
+            dataset[i]
+        return len(dataset)
+    return run, file_mb(audio_paths)
+
+
+def setup_collate_fn(fixture, args, collate=None):
+    from dataset import AudioDataset, collate_fn
+    collate = collate or collate_fn
+    dataset = AudioDataset(fixture["audio_dir"], fixture["label_dir"], n_feats=args.n_feats)
+    with contextlib.redirect_stdout(io.StringIO()):
+        items = [dataset[i] for i in range(len(dataset))]
+    batches = [items[i:i + args.batch_size] for i in range(0, len(items), args.batch_size)]
+    megabytes = sum(item[0].numel() * item[0].element_size() for item in items) / 1e6
+
+    def run():
+        for batch in batches:
+            collate(batch)
+        return len(items)
+    return run, megabytes
+
+
+def setup_contiguous_collate(fixture, args):
+    from dataset import ContiguousCollate
+    return setup_collate_fn(fixture, args, ContiguousCollate())
+
+
+def setup_text(fixture, args):
+    from utils.text import TextProcess
+    text_process = TextProcess()
+    labels = []
+    for name in sorted(os.listdir(fixture["label_dir"])):
+        with open(os.path.join(fixture["label_dir"], name)) as file:
+            labels.append(file.read())
+    labels = labels * args.text_repeat
+
+    def run():
+        text_process.encode_batch([text_process.clean_text(label) for label in labels])
+        return len(labels)
+    return run, sum(len(label.encode("utf-8")) for label in labels) / 1e6
+
+
+def setup_txt_to_trans(fixture, args):
+    from preprocess import txt_to_trans
+    srt_paths = [os.path.join(talk, "srt_transcript.txt") for talk in fixture["talks"]]
+
+    def run():
+        return sum(len(txt_to_trans(srt_path, str(i))[0]) for i, srt_path in enumerate(srt_paths))
+    return run, file_mb(srt_paths)
+
+
+def setup_convert(fixture, args):
+    import preprocess
+    output_dir = tempfile.mkdtemp(dir=fixture["root"])
+    preprocess.path = output_dir
+    preprocess.txt_src_path = os.path.join(output_dir, "txt_src.txt")
+    talks_dir = os.path.dirname(fixture["talks"][0])
+
+    def run():
+        preprocess.convert(talks_dir, output_format="files", audio_format="wav", workers=args.workers)
+        return len(fixture["talks"])
+    return run, fixture["talks_bytes"] / 1e6
+
+
+SETUP = {
+    "getitem": setup_getitem,
+    "collate_fn": setup_collate_fn,
+    "contiguous_collate": setup_contiguous_collate,
+    "text": setup_text,
+    "txt_to_trans": setup_txt_to_trans,
+    "convert": setup_convert,
+}
+
+
+def run_stage(name, fixture, args):
+    """
+    Runs one stage; called in a spawned process.
+    :return: Returns the stage's result dict.
+    """
+    run, megabytes = SETUP[name](fixture, args)
+    reset_peak_memory()
+    baseline_rss = memory_mb("VmRSS")
+    with contextlib.redirect_stdout(io.StringIO()):  # keep progress output of the stages out of the report
+        start = time.perf_counter()
+        items = run()
+        seconds = time.perf_counter() - start
+    peak_rss = memory_mb("VmHWM")
+    return {
+        "items": items,
+        "seconds": seconds,
+        "items_per_sec": items / seconds,
+        "mb": megabytes,
+        "mb_per_sec": megabytes / seconds,
+        "peak_rss_mb": peak_rss,
+        "stage_rss_mb": peak_rss - baseline_rss,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    print(f"\nCompared with {baseline['meta'].get('revision')} ({baseline['meta'].get('date')}):")
+    for name, stage in results["stages"].items():
+        before = baseline["stages"].get(name)
+        if not before:
+            continue
+        speedup = stage["items_per_sec"] / before["items_per_sec"]
+        print(f"{name:>18}: {speedup:6.2f}x items/s, stage memory {before['stage_rss_mb']:7.1f} -> "
+              f"{stage['stage_rss_mb']:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--items", type=int, default=200, help="utterances in the audio dataset")
+    parser.add_argument("--min-seconds", type=float, default=1.0, help="shortest utterance")
+    parser.add_argument("--max-seconds", type=float, default=6.0, help="longest utterance")
+    parser.add_argument("--talks", type=int, default=4, help="talk folders for txt_to_trans and convert")
+    parser.add_argument("--cues", type=int, default=40, help="cues per talk, about 2.5 s of audio each")
+    parser.add_argument("--n-feats", type=int, default=128)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--text-repeat", type=int, default=20, help="passes over the labels in the text stage")
+    parser.add_argument("--workers", type=int, default=1, help="convert workers")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="an earlier JSON result file to compare with")
+    args = parser.parse_args()
+
+    results = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "stages": {},
+    }
+    with tempfile.TemporaryDirectory() as root:
+        fixture = {"root": root}
+        start = time.perf_counter()
+        if {"getitem", "collate_fn", "contiguous_collate", "text"} & set(args.stages):
+            audio_dir, label_dir, _ = make_audio_dataset(os.path.join(root, "dataset"), args.items, args.min_seconds,
+                                                         args.max_seconds, seed=args.seed)
+            fixture.update(audio_dir=audio_dir, label_dir=label_dir)
+        if {"txt_to_trans", "convert"} & set(args.stages):
+            talks, talks_bytes = make_talks(os.path.join(root, "talks"), args.talks, args.cues, seed=args.seed)
+            fixture.update(talks=talks, talks_bytes=talks_bytes)
+        print(f"Fixtures generated in {time.perf_counter() - start:.1f}s")
+
+        context = multiprocessing.get_context("spawn")
+        for name in args.stages:
+            with context.Pool(1) as pool:
+                stage = pool.apply(run_stage, (name, fixture, args))
+            results["stages"][name] = stage
+            print(f"{name:>18}: {stage['items_per_sec']:>10,.1f} items/s  {stage['mb_per_sec']:>8.2f} MB/s  "
+                  f"peak {stage['peak_rss_mb']:7.1f} MB (+{stage['stage_rss_mb']:.1f})  "
+                  f"({stage['items']} items in {stage['seconds']:.2f}s)")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=1)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Throughput of the streaming SRT parser on a synthetic subtitle corpus.
+
+Compares subtitles.iter_srt_cues with the readlines() based parser txt_to_trans used before.
+Run from the repo root:  python benchmarks/bench_srt.py --files 200 --cues 2000
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scraper"))
+from subtitles import iter_srt_cues
+from fixtures import write_srt
+
+
+def to_ms(string):
+    string = string.replace(",", "")
+    hour, minute, second = string.split(":")
+    return int(second) + int(hour) * 3600 * 1000 + int(minute) * 60 * 1000
+
+
+def legacy_parse(srt_path):
+    """
+    The parsing part of the previous txt_to_trans, for comparison.
+    """
+    with open(srt_path, "r") as file:
+        lines = file.readlines()
+    cues = []
+    for i in range(len(lines)):
+        idx = re.search(r"^[\d]+$", lines[i].strip("\ufeff"))
+        if idx:
+            time_frame = re.findall("[0-9]{2}:[0-9]{2}:[0-9]{2},[0-9]{3}", lines[i + 1])
+            if time_frame:
+                cues.append((idx[0], to_ms(time_frame[0]), to_ms(time_frame[1]), lines[i + 2]))
+    return cues
+
+
+def streaming_parse(srt_path):
+    return list(iter_srt_cues(srt_path))
+
+
+def run(parse, srt_paths, corpus_bytes):
+    start = time.perf_counter()
+    number_of_cues = sum(len(parse(srt_path)) for srt_path in srt_paths)
+    elapsed = time.perf_counter() - start
+    return {
+        "cues": number_of_cues,
+        "seconds": elapsed,
+        "cues_per_sec": number_of_cues / elapsed,
+        "mb_per_sec": corpus_bytes / elapsed / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200, help="number of SRT files in the corpus")
+    parser.add_argument("--cues", type=int, default=2000, help="cues per SRT file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        srt_paths = [os.path.join(corpus_dir, f"{i}.srt") for i in range(args.files)]
+        for srt_path in srt_paths:
+            write_srt(srt_path, args.cues, rng)
+        corpus_bytes = sum(os.path.getsize(srt_path) for srt_path in srt_paths)
+        print(f"Corpus: {args.files} files, {args.files * args.cues} cues, {corpus_bytes / 1e6:.1f} MB")
+
+        for name, parse in (("legacy readlines", legacy_parse), ("streaming", streaming_parse)):
+            result = run(parse, srt_paths, corpus_bytes)
+            print(f"{name:>18}: {result['cues_per_sec']:>12,.0f} cues/s  {result['mb_per_sec']:>8.1f} MB/s  "
+                  f"({result['cues']} cues in {result['seconds']:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
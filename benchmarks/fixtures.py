@@ -0,0 +1,114 @@
+"""
+Synthetic fixtures for the benchmarks: utterance datasets in the AudioDataset layout, SRT files and talk folders
+in the layout the scraper writes. Everything is generated locally from a seed.
+"""
+
+import os
+import random
+import wave
+
+import numpy as np
+
+WORDS = "we are going to talk about the ideas that change how people see the world and themselves".split()
+NUMBERS = ["1999", "2012", "42", "7", "100", "3"]
+
+
+def format_timestamp(ms):
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+
+def random_caption(rng, min_words=3, max_words=10):
+    words = rng.choices(WORDS, k=rng.randint(min_words, max_words))
+    if rng.random() < 0.2:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(NUMBERS))
+    return " ".join(words)
+
+
+def write_srt(srt_path, number_of_cues, rng, max_ms=None):
+    """
+    Writes a synthetic SRT file, with roughly a third of the captions spanning two lines.
+    With max_ms, cue times are scaled so the last cue ends at max_ms.
+    :return: Returns the number of bytes written.
+    """
+    cues = []
+    start = 0
+    for _ in range(number_of_cues):
+        start += rng.randint(200, 3000)
+        end = start + rng.randint(800, 6000)
+        cues.append((start, end))
+        start = end
+    scale = max_ms / start if max_ms and start else 1.0
+    with open(srt_path, "w", encoding="utf-8") as file:
+        for index, (start, end) in enumerate(cues, 1):
+            lines = [random_caption(rng)]
+            if rng.random() < 0.3:
+                lines.append(random_caption(rng, 3, 8))
+            timing = f"{format_timestamp(int(start * scale))} --> {format_timestamp(int(end * scale))}"
+            file.write(f"{index}\n{timing}\n" + "\n".join(lines) + "\n\n")
+    return os.path.getsize(srt_path)
+
+
+def synthetic_speech(rng, seconds, sample_rate):
+    """
+    Noise shaped by a few sines with a syllable-rate envelope, as int16 samples; cheap to generate and not
+    silent, so decoders and feature extraction do their full work.
+    """
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    signal = sum(np.sin(2 * np.pi * rng.uniform(100, 3000) * t) for _ in range(3))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+    noise = np.random.default_rng(rng.randrange(2 ** 32)).standard_normal(len(t))
+    samples = (signal / 3 + 0.1 * noise) * envelope * 0.3
+    return (samples * 32767).astype(np.int16)
+
+
+def write_wav(wav_path, samples, sample_rate, channels=1):
+    if channels > 1:
+        samples = np.repeat(samples[:, None], channels, axis=1)
+    with wave.open(wav_path, "wb") as file:
+        file.setnchannels(channels)
+        file.setsampwidth(2)
+        file.setframerate(sample_rate)
+        file.writeframes(samples.tobytes())
+
+
+def make_audio_dataset(root, count, min_seconds=1.0, max_seconds=6.0, sample_rate=16000, channels=1, seed=0):
+    """
+    Writes count utterances as <root>/audio/utt-<i>.wav and <root>/label/utt-<i>.txt, the layout AudioDataset reads.
+    :return: Returns (audio_dir, label_dir, total audio bytes).
+    """
+    rng = random.Random(seed)
+    audio_dir, label_dir = os.path.join(root, "audio"), os.path.join(root, "label")
+    os.makedirs(audio_dir, exist_ok=True)
+    os.makedirs(label_dir, exist_ok=True)
+    total_bytes = 0
+    for i in range(count):
+        wav_path = os.path.join(audio_dir, f"utt-{i}.wav")
+        write_wav(wav_path, synthetic_speech(rng, rng.uniform(min_seconds, max_seconds), sample_rate), sample_rate, channels)
+        total_bytes += os.path.getsize(wav_path)
+        with open(os.path.join(label_dir, f"utt-{i}.txt"), "w") as file:
+            file.write(random_caption(rng, 5, 20))
+    return audio_dir, label_dir, total_bytes
+
+
+def make_talks(root, count, cues=40, sample_rate=44100, seed=0):
+    """
+    Writes count talk folders with an audio.mp3 and an srt_transcript.txt, as the scraper saves them.
+    Talks last about 2.5 s per cue and the SRT covers the whole audio, so every talk passes the quality checks.
+    Needs ffmpeg for the mp3 encoding, through pydub.
+    :return: Returns (list of talk folders, total source bytes).
+    """
+    from pydub import AudioSegment
+
+    rng = random.Random(seed)
+    talks, total_bytes = [], 0
+    for i in range(count):
+        talk_path = os.path.join(root, f"talk_{i:04d}")
+        os.makedirs(talk_path, exist_ok=True)
+        seconds = cues * 2.5
+        samples = synthetic_speech(rng, seconds, sample_rate)
+        audio = AudioSegment(samples.tobytes(), frame_rate=sample_rate, sample_width=2, channels=1)
+        audio.export(os.path.join(talk_path, "audio.mp3"), format="mp3")
+        write_srt(os.path.join(talk_path, "srt_transcript.txt"), cues, rng, max_ms=int(seconds * 1000))
+        total_bytes += sum(os.path.getsize(os.path.join(talk_path, name)) for name in os.listdir(talk_path))
+        talks.append(talk_path)
+    return talks, total_bytes
@@ -1,27 +1,78 @@
+import io
 import os
+import random
+import numpy as np
 import torch
 import torchaudio
 import torchaudio.transforms as T
 from torchaudio.compliance.kaldi import mfcc
 from utils.text import TextProcess
+from utils.cache import FeatureCache
+from utils.manifest import Manifest
+from utils.features import KaldiMFCC, resampler, resampled_num_samples
+from utils.shards import read_index, iter_shard
+from utils.instrumentation import LoaderStats, stage_timer
+from utils.waveform_store import WaveformStore, to_float
+
+MFCC_SAMPLE_RATE = 16000 # default rate audio is resampled to before kaldi mfcc
+
+def compute_mfcc(waveform, n_feats, frame_length=25, frame_shift=10, sample_rate=MFCC_SAMPLE_RATE):
+    """ (1, samples) waveform at sample_rate -> MFCCs shaped (1, n_feats, frames) """
+    spectrogram = mfcc(waveform, frame_length=frame_length, frame_shift=frame_shift, num_ceps=n_feats, num_mel_bins=n_feats,
+                       sample_frequency=sample_rate) # spectrogram = self.transform(waveform)
+    return spectrogram.transpose(0, 1).unsqueeze(0) # (frames, n_feats) -> (1, n_feats, frames) as collate_fn expects
+
+def downmix_resample(waveform, orig_freq, new_freq, stats=None):
+    """
+    (channels, samples) waveform at orig_freq -> mono (1, samples') at new_freq, the layout kaldi mfcc expects.
+    Both steps are linear, so downmixing first gives the same result as resampling every channel, for the
+    resampling cost of one channel. Kernels come from the per-process resampler cache.
+    """
+    with stage_timer(stats, 'downmix'):
+        waveform = torch.mean(waveform, dim=0, keepdim=True)
+    if orig_freq != new_freq:
+        with stage_timer(stats, 'resample'):
+            waveform = resampler(orig_freq, new_freq)(waveform)
+    return waveform
 
 class AudioDataset(torch.utils.data.Dataset):
     """
     Load data from directory.
     wav audio is transformed to spectogram.
     Return (spectrogram, label, spec_len, label_len) to dataloader
+    Audio files are paired with labels by utterance id through a persisted manifest, rebuilt when audio or label
+    files are added, removed or modified.
+    Audio is downmixed and resampled to sample_rate on the fly, whatever rate the files were saved at.
+    If cache_dir is given, features are computed once and read back from the on-disk cache in later epochs.
+    With return_waveform=True, items are (waveform, label, num_samples, label_len) and features are computed
+    per batch by BatchFeatureCollate instead.
+    With instrument=True, self.stats (a LoaderStats) times every loading stage, in every DataLoader worker;
+    pass it to collate_fn / BatchFeatureCollate to time padding as well.
+    If store_dir is given, every waveform is decoded once into a WaveformStore there (rebuilt when the manifest or
+    sample_rate changes), and items are read from its shared memory-mapped file instead of decoding the audio files.
+    Waveform items are then zero-copy int16 tensors, which BatchFeatureCollate converts to float.
+    With crop_seconds, items longer than that are cut to a random window of crop_seconds (different every epoch,
+    see set_epoch), chosen from the manifest duration and decoded on its own by seeking to it, so decoding
+    costs the window and not the whole file. Cropped items bypass the feature cache.
+    alignments maps utterance ids to word timings [(start_seconds, end_seconds, word), ...]; the label of a
+    cropped item with known alignment is the words inside the window, other items keep their whole label.
     """
 
-    def __init__(self, audio_dir, label_dir, sample_rate=16000, n_feats=128, transform=None):
-        labels = []
-        for file in os.listdir(label_dir): # load labels from directory to list
-            if file.endswith('.txt'):
-                filepath = os.path.join(label_dir, file)
-                with open(filepath) as f_input:
-                    labels.append(f_input.read())
-        self.labels = labels
+    def __init__(self, audio_dir, label_dir, sample_rate=MFCC_SAMPLE_RATE, n_feats=128, transform=None, cache_dir=None,
+                 manifest_dir=None, rebuild_manifest=False, return_waveform=False, instrument=False, store_dir=None,
+                 rebuild_store=False, crop_seconds=None, alignments=None, seed=0):
+        # audio <-> label <-> duration table, built on first use and persisted (default: <audio_dir>/.manifest)
+        self.manifest = Manifest.open(audio_dir, label_dir, manifest_dir, rebuild=rebuild_manifest)
         self.audio_dir = audio_dir
+        self.sample_rate = sample_rate
         self.n_feats = n_feats
+        self.frame_length = 25
+        self.frame_shift = 10
+        self.return_waveform = return_waveform
+        self.crop_seconds = crop_seconds
+        self.alignments = alignments or {}
+        self.seed = seed
+        self.epoch = 0
         # if transform:
         #     self.transform = transform
         # else:
@@ -31,34 +82,203 @@ class AudioDataset(torch.utils.data.Dataset):
         #         # T.LogMelSpec(sample_rate=sample_rate, n_mels=n_feats,  win_length=160, hop_length=80)
         #     )
         self.text_process = TextProcess()
+        self.stats = LoaderStats() if instrument else None
+        self.store = None
+        if store_dir:
+            self.store = WaveformStore.open(store_dir, self.manifest, self.load_waveform, sample_rate, rebuild=rebuild_store)
+            if self.stats:
+                self.stats.reset() # leave the decoding done to build the store out of the loader stats
+        self.feature_cache = None
+        if cache_dir:
+            # resampled=True keeps entries computed at the file's own rate, before resampling, from matching;
+            # source keeps features of the int16 store samples apart from those of the float decoded audio
+            self.feature_cache = FeatureCache(cache_dir, n_feats=n_feats, frame_length=self.frame_length, sample_rate=sample_rate,
+                                              resampled=True, source='decode' if self.store is None else 'store')
 
     def __len__(self):
-        return len(os.listdir(self.audio_dir))
+        return len(self.manifest)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    @property
+    def lengths(self):
+        """ Feature frame count of every item, computed from the manifest without decoding audio """
+        window_size = self.sample_rate * self.frame_length // 1000
+        window_shift = self.sample_rate * self.frame_shift // 1000
+        num_frames = self.manifest.num_frames
+        if self.crop_seconds is not None:
+            num_frames = np.minimum(num_frames, (self.crop_seconds * self.manifest.sample_rates).astype(np.int64))
+        num_samples = resampled_num_samples(num_frames, self.manifest.sample_rates, self.sample_rate)
+        return np.maximum(num_samples - window_size, -1) // window_shift + 1
+
+    def crop_window(self, index):
+        """
+        Random (frame_offset, num_frames) window of crop_seconds in the item's own frames, from the manifest,
+        or None when not cropping or the item is not longer than the window
+        """
+        if self.crop_seconds is None:
+            return None
+        num_frames = int(self.crop_seconds * self.manifest.sample_rates[index])
+        total_frames = int(self.manifest.num_frames[index])
+        if total_frames <= num_frames:
+            return None
+        rng = random.Random(f'{self.seed}-{self.epoch}-{index}')
+        return rng.randrange(total_frames - num_frames + 1), num_frames
+
+    def crop_label(self, index, label, window):
+        """ The words of label inside window, when the utterance has a known alignment """
+        utt_id = os.path.splitext(os.path.basename(self.manifest.audio_path(index)))[0]
+        if window is None or utt_id not in self.alignments:
+            return label
+        sample_rate = self.manifest.sample_rates[index]
+        start, end = window[0] / sample_rate, (window[0] + window[1]) / sample_rate
+        return ' '.join(word for word_start, word_end, word in self.alignments[utt_id] if word_start >= start and word_end <= end)
+
+    def load_waveform(self, audio_path, window=None):
+        """
+        Read and decode audio_path, downmix it and resample it to a (1, samples) tensor at self.sample_rate.
+        With a (frame_offset, num_frames) window only that part of the file is decoded.
+        """
+        with stage_timer(self.stats, 'decode'): # reading the file is part of decoding; the decoder seeks for a window
+            if window is None:
+                waveform, sample_rate = torchaudio.load(audio_path)
+            else:
+                waveform, sample_rate = torchaudio.load(audio_path, frame_offset=window[0], num_frames=window[1])
+        return downmix_resample(waveform, sample_rate, self.sample_rate, self.stats)
+
+    def features(self, waveform):
+        """ (1, samples) waveform at self.sample_rate -> MFCCs shaped (1, n_feats, frames) """
+        with stage_timer(self.stats, 'features'):
+            return compute_mfcc(waveform, self.n_feats, self.frame_length, self.frame_shift, self.sample_rate)
+
+    def compute_features(self, audio_path, window=None):
+        """ Decode audio_path (or the window of it) and return its MFCCs shaped (1, n_feats, frames) """
+        return self.features(self.load_waveform(audio_path, window))
+
+    def store_waveform(self, index, window=None):
+        """ int16 samples of an utterance (or the window of it) from the waveform store, a view of the shared mapping """
+        with stage_timer(self.stats, 'open'):
+            waveform = self.store.waveform(index)
+            if window is not None:
+                source_rate = int(self.manifest.sample_rates[index])
+                start = window[0] * self.sample_rate // source_rate
+                waveform = waveform[start:start + int(resampled_num_samples(window[1], source_rate, self.sample_rate))]
+        return waveform
+
+    def store_features(self, index, window=None):
+        """ MFCCs of an utterance (or the window of it) from the waveform store, shaped (1, n_feats, frames) """
+        return self.features(to_float(self.store_waveform(index, window)).unsqueeze(0))
 
     def __getitem__(self, index):
-        audio_path = os.path.join(self.audio_dir, os.listdir(self.audio_dir)[index])
-        waveform, sample_rate = torchaudio.load(audio_path)
-        waveform = torch.mean(waveform, dim=0)#.unsqueeze(0)
-        spectrogram = mfcc(waveform, frame_length=25, num_ceps=self.n_feats, num_mel_bins=self.n_feats) # spectrogram = self.transform(waveform)
-        label = self.text_process.clean_text(self.labels[index])
-        # print(label)
-        label = self.text_process.text_to_int_sequence(label)
-        # print(label)
-        label = torch.tensor(label)
+        audio_path = self.manifest.audio_path(index)
+        window = self.crop_window(index)
+        label = (self.manifest if self.store is None else self.store).label(index)
+        label = self.crop_label(index, label, window)
+        with stage_timer(self.stats, 'text_clean'):
+            label = self.text_process.clean_text(label)
+        with stage_timer(self.stats, 'text_encode'):
+            label, _ = self.text_process.encode_batch([label])
+
+        if self.return_waveform:
+            if self.store is not None:
+                waveform = self.store_waveform(index, window)
+            else:
+                waveform = self.load_waveform(audio_path, window)[0]
+            return waveform, label, waveform.shape[-1], len(label)
 
+        use_cache = self.feature_cache is not None and window is None # crops differ every epoch
+        spectrogram = self.feature_cache.load(audio_path) if use_cache else None
+        if spectrogram is None:
+            if self.store is not None:
+                spectrogram = self.store_features(index, window)
+            else:
+                spectrogram = self.compute_features(audio_path, window)
+            if use_cache:
+                self.feature_cache.store(audio_path, spectrogram)
         spec_len = spectrogram.shape[-1] // 2
         label_len = len(label)
-        print(f'Spectrogram length {spectrogram.shape}, label length {label_len}')
         return spectrogram, label, spec_len, label_len
 
 
 
-def collate_fn(batch):
+class ShardDataset(torch.utils.data.IterableDataset):
+    """
+    Stream utterances from the tar shards written by preprocess.convert(output_format='shards').
+    Shards are read sequentially; their order is shuffled every epoch and they are split across DataLoader
+    workers, and a buffer of shuffle_buffer utterances shuffles within and across shards.
+    Yields the same tuples as AudioDataset, so collate_fn and BatchFeatureCollate work unchanged.
+    instrument=True times the stages as AudioDataset does, in self.stats; reading the shards is not timed.
+    """
+
+    def __init__(self, shard_dir, n_feats=128, shuffle=True, shuffle_buffer=1000, seed=0, return_waveform=False,
+                 instrument=False, sample_rate=MFCC_SAMPLE_RATE):
+        self.shards = [(os.path.join(shard_dir, shard['name']), shard['skip_talks']) for shard in read_index(shard_dir)]
+        self.sample_rate = sample_rate
+        self.n_feats = n_feats
+        self.frame_length = 25
+        self.frame_shift = 10
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer if shuffle else 0
+        self.seed = seed
+        self.epoch = 0
+        self.return_waveform = return_waveform
+        self.text_process = TextProcess()
+        self.stats = LoaderStats() if instrument else None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _make_item(self, sample):
+        with stage_timer(self.stats, 'decode'):
+            waveform, sample_rate = torchaudio.load(io.BytesIO(sample['audio']), format=sample['audio_ext'])
+        waveform = downmix_resample(waveform, sample_rate, self.sample_rate, self.stats)
+        with stage_timer(self.stats, 'text_clean'):
+            label = self.text_process.clean_text(sample['label'])
+        with stage_timer(self.stats, 'text_encode'):
+            label, _ = self.text_process.encode_batch([label])
+        if self.return_waveform:
+            return waveform[0], label, waveform.shape[-1], len(label)
+        with stage_timer(self.stats, 'features'):
+            spectrogram = compute_mfcc(waveform, self.n_feats, self.frame_length, self.frame_shift, self.sample_rate)
+        return spectrogram, label, spectrogram.shape[-1] // 2, len(label)
+
+    def __iter__(self):
+        shards = list(self.shards)
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(shards) # same order in every worker
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id = 0
+        if worker_info is not None:
+            worker_id = worker_info.id
+            shards = shards[worker_id::worker_info.num_workers]
+        rng = random.Random(f'{self.seed}-{self.epoch}-{worker_id}')
+
+        # samples are buffered still encoded and only decoded when yielded
+        buffer = []
+        for shard_path, skip_talks in shards:
+            for sample in iter_shard(shard_path, skip_talks):
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(sample)
+                    continue
+                if buffer:
+                    pick = rng.randrange(len(buffer))
+                    buffer[pick], sample = sample, buffer[pick]
+                yield self._make_item(sample)
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield self._make_item(sample)
+
+
+
+def collate_fn(batch, stats=None):
 
     """
     Pad sequence to spectograms and labels by batch
     A data tuple has the form:
     spectrogram, label, input_length, label_length
+    stats: optional LoaderStats (e.g. dataset.stats) to time the padding,
+    use functools.partial(collate_fn, stats=dataset.stats) as the DataLoader collate_fn
     """
 
     spectrograms = []
@@ -74,8 +294,85 @@ def collate_fn(batch):
         label_lengths += [label_length]
 
     # Group the list of tensors into a batched tensor
-    spectrograms = torch.nn.utils.rnn.pad_sequence(spectrograms, batch_first=True, padding_value=0.).unsqueeze(1).transpose(2, 3)
-    print(spectrograms.shape)
-    labels = torch.nn.utils.rnn.pad_sequence(labels, batch_first=True) #torch.stack(labels)
+    with stage_timer(stats, 'padding'):
+        spectrograms = torch.nn.utils.rnn.pad_sequence(spectrograms, batch_first=True, padding_value=0.).unsqueeze(1).transpose(2, 3)
+        labels = torch.nn.utils.rnn.pad_sequence(labels, batch_first=True) #torch.stack(labels)
+
+    return spectrograms, labels, input_lengths, label_lengths
+
+
+class ContiguousCollate:
+    """
+    collate_fn for AudioDataset items that sizes one output buffer from the batch maxima and copies every item
+    into it once, instead of collate_fn's transposes, pad_sequence and final transpose.
+    Returns contiguous (batch, 1, n_feats, frames) spectrograms and (batch, max label length) labels, with int32
+    input_lengths and label_lengths tensors as nn.CTCLoss takes them.
+    pin_memory allocates the buffers in pinned memory (ignored without CUDA); pinning belongs in the process that
+    moves batches to the GPU, so with DataLoader workers prefer DataLoader(pin_memory=True).
+    stats: optional LoaderStats (e.g. dataset.stats) to time the padding.
+    augment: optional utils.augment.BatchAugment; its SpecAugment masks are applied to the padded batch.
+    """
+
+    def __init__(self, pin_memory=False, stats=None, augment=None):
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.stats = stats
+        self.augment = augment
+
+    def __call__(self, batch):
+        spectrograms, labels, input_lengths, label_lengths = zip(*batch)
+        with stage_timer(self.stats, 'padding'):
+            _, n_feats, _ = spectrograms[0].shape
+            max_frames = max(spectrogram.shape[-1] for spectrogram in spectrograms)
+            max_label_length = max(len(label) for label in labels)
+            spectrogram_batch = torch.zeros(len(batch), 1, n_feats, max_frames, dtype=spectrograms[0].dtype,
+                                            pin_memory=self.pin_memory)
+            label_batch = torch.zeros(len(batch), max_label_length, dtype=labels[0].dtype, pin_memory=self.pin_memory)
+            for row, spectrogram in zip(spectrogram_batch, spectrograms):
+                row[..., :spectrogram.shape[-1]] = spectrogram
+            for row, label in zip(label_batch, labels):
+                row[:len(label)] = label
+        if self.augment is not None:
+            with stage_timer(self.stats, 'augment'):
+                generator = self.augment.generator(label_batch, label_lengths)
+                self.augment.spectrograms(spectrogram_batch, [spectrogram.shape[-1] for spectrogram in spectrograms], generator)
+        input_lengths = torch.tensor(input_lengths, dtype=torch.int32)
+        label_lengths = torch.tensor(label_lengths, dtype=torch.int32)
+        if self.pin_memory:
+            input_lengths, label_lengths = input_lengths.pin_memory(), label_lengths.pin_memory()
+        return spectrogram_batch, label_batch, input_lengths, label_lengths
+
+
+class BatchFeatureCollate:
+    """
+    collate_fn for AudioDataset(return_waveform=True).
+    Pads the raw waveforms and computes MFCCs for the whole batch in one vectorized call, matching the per-item
+    kaldi mfcc path. Returns the same (spectrograms, labels, input_lengths, label_lengths) as collate_fn, with
+    input_lengths derived from the exact frame count of each item.
+    sample_rate must match the dataset's sample_rate, the rate the waveforms are resampled to.
+    stats: optional LoaderStats (e.g. dataset.stats) to time padding and feature extraction.
+    augment: optional utils.augment.BatchAugment; speed and volume perturbation are applied to the padded
+    waveforms and SpecAugment masks to the features, with input_lengths following the speed perturbation.
+    """
+
+    def __init__(self, n_feats, frame_length=25, frame_shift=10, sample_rate=MFCC_SAMPLE_RATE, stats=None, augment=None):
+        self.mfcc = KaldiMFCC(n_feats, frame_length=frame_length, frame_shift=frame_shift, sample_rate=sample_rate)
+        self.stats = stats
+        self.augment = augment
 
-    return spectrograms, labels, input_lengths, label_lengths
\ No newline at end of file
+    def __call__(self, batch):
+        waveforms, labels, num_samples, label_lengths = zip(*batch)
+        with stage_timer(self.stats, 'padding'):
+            waveforms = to_float(torch.nn.utils.rnn.pad_sequence(waveforms, batch_first=True, padding_value=0))
+            labels = torch.nn.utils.rnn.pad_sequence(labels, batch_first=True)
+        if self.augment is not None:
+            with stage_timer(self.stats, 'augment'):
+                generator = self.augment.generator(labels, label_lengths)
+                waveforms, num_samples = self.augment.waveforms(waveforms, num_samples, generator)
+        with stage_timer(self.stats, 'features'):
+            spectrograms, frame_lengths = self.mfcc(waveforms, num_samples)
+        spectrograms = spectrograms.unsqueeze(1) # (batch, 1, n_feats, frames)
+        if self.augment is not None:
+            with stage_timer(self.stats, 'augment'):
+                self.augment.spectrograms(spectrograms, frame_lengths, generator)
+        input_lengths = (frame_lengths // 2).tolist()
+        return spectrograms, labels, input_lengths, list(label_lengths)
\ No newline at end of file
@@ -0,0 +1,163 @@
+"""
+Audio-track extraction with ffmpeg. Only the audio stream of a video is demuxed and encoded;
+the video stream is never decoded.
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+
+FFMPEG_BINARY = "ffmpeg"
+
+
+class ExtractionError(RuntimeError):
+    """ ffmpeg could not extract an audio track """
+
+
+def ffmpeg_binary():
+    """
+    Locates ffmpeg, preferring the one on PATH and falling back to the binary bundled with imageio-ffmpeg.
+    :return: Returns the path to the ffmpeg executable.
+    """
+    binary = shutil.which(FFMPEG_BINARY)
+    if binary:
+        return binary
+    try:
+        import imageio_ffmpeg
+    except ImportError:
+        raise ExtractionError("ffmpeg was not found on PATH and imageio-ffmpeg is not installed.")
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def mp4_index_first(head):
+    """
+    Checks whether an mp4/mov stream has its index ('moov' atom) before its media data ('mdat'), which ffmpeg needs
+    to read it from a pipe. Given a moov at the end, ffmpeg reading a pipe exits successfully with empty output.
+    :param head: The first bytes of the stream.
+    :return: Returns True or False, or None when head is not an mp4 or too short to tell.
+    """
+    if head[4:8] != b"ftyp":
+        return None
+    position = 0
+    while position + 8 <= len(head):
+        size, box_type = struct.unpack(">I4s", head[position:position + 8])
+        if box_type == b"moov":
+            return True
+        if box_type == b"mdat":
+            return False
+        if size == 1:
+            if position + 16 > len(head):
+                return None
+            size = struct.unpack(">Q", head[position + 8:position + 16])[0]
+        if size < 8:
+            return None
+        position += size
+    return None
+
+
+def _ffmpeg_command(source, output_path, sample_rate=None, channels=None):
+    # ffmpeg writes how much audio it produced to the progress file, which _finish reads back
+    command = [ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-nostats", "-progress", output_path + ".progress",
+               "-y", "-i", source, "-map", "0:a:0", "-vn", "-sn", "-dn"]
+    if sample_rate:
+        command += ["-ar", str(sample_rate)]
+    if channels:
+        command += ["-ac", str(channels)]
+    audio_format = os.path.splitext(output_path)[1][1:]
+    return command + ["-f", audio_format, output_path + ".tmp"]
+
+
+def _output_seconds(progress_path):
+    """ Duration of the audio ffmpeg wrote, from the last out_time_us of its progress file, or 0 """
+    seconds = 0.0
+    try:
+        with open(progress_path) as file:
+            for line in file:
+                key, _, value = line.strip().partition("=")
+                if key == "out_time_us" and value.lstrip("-").isdigit():
+                    seconds = max(int(value), 0) / 1e6
+    except FileNotFoundError:
+        pass
+    return seconds
+
+
+def _finish(process_returncode, stderr, output_path):
+    """
+    Moves the output into place once ffmpeg has succeeded. ffmpeg can also exit successfully without writing any
+    audio, e.g. reading an mp4 from a pipe whose index could not be found, so empty output is an error too.
+    """
+    seconds = _output_seconds(output_path + ".progress")
+    if os.path.isfile(output_path + ".progress"):
+        os.remove(output_path + ".progress")
+    if process_returncode != 0 or seconds <= 0:
+        if os.path.isfile(output_path + ".tmp"):
+            os.remove(output_path + ".tmp")
+        if process_returncode != 0:
+            raise ExtractionError(stderr.decode("utf-8", errors="replace").strip() or f"ffmpeg exited with {process_returncode}")
+        raise ExtractionError("ffmpeg produced no audio.")
+    os.replace(output_path + ".tmp", output_path)
+
+
+def extract_audio(source_path, output_path, sample_rate=None, channels=None):
+    """
+    Extracts the first audio track of a media file. The output format follows the extension of output_path,
+    and the file only appears under that name once ffmpeg has succeeded.
+    :param source_path: The video (or any media) file.
+    :param output_path: The audio file to write, e.g. ".../audio.mp3".
+    :param sample_rate: Optional output sample rate, e.g. 16000 for the training format; defaults to the source rate.
+    :param channels: Optional number of output channels, e.g. 1 to downmix.
+    :return: No return value. Raises ExtractionError when ffmpeg fails.
+    """
+    command = _ffmpeg_command(source_path, output_path, sample_rate, channels)
+    process = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    _finish(process.returncode, process.stderr, output_path)
+
+
+def extract_audio_from_chunks(chunks, output_path, sample_rate=None, channels=None):
+    """
+    Extracts the first audio track of a media stream fed to ffmpeg's stdin, e.g. the chunks of a download, so the
+    stream never has to be stored. This only works for containers that can be read without seeking, so only mp4
+    streams whose index ('moov' atom) is found before the media data are piped; for anything else, including
+    streams whose head is too short or unusual to tell, ExtractionError is raised before anything is run, and the
+    caller downloads the file instead.
+    :param chunks: An iterable of bytes.
+    :param output_path: The audio file to write.
+    :param sample_rate: Optional output sample rate.
+    :param channels: Optional number of output channels.
+    :return: No return value. Raises ExtractionError when ffmpeg fails.
+    """
+    chunks = iter(chunks)
+    head = next(chunks, b"")
+    index_first = mp4_index_first(head)
+    if index_first is False:
+        raise ExtractionError("The mp4 index is stored after the media data, so it cannot be read as a stream.")
+    if index_first is None:
+        raise ExtractionError("The stream is not an mp4 with its index up front, so it cannot be read as a stream.")
+
+    command = _ffmpeg_command("pipe:0", output_path, sample_rate, channels)
+    # stderr goes to a file: a pipe nobody reads while stdin is written could fill up and block ffmpeg
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr_file)
+        try:
+            process.stdin.write(head)
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            pass  # ffmpeg stopped reading; its exit status and stderr say why
+        except BaseException:
+            process.kill()
+            process.communicate()
+            for leftover_path in (output_path + ".tmp", output_path + ".progress"):
+                if os.path.isfile(leftover_path):
+                    os.remove(leftover_path)
+            raise
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = process.wait()
+        stderr_file.seek(0)
+        stderr = stderr_file.read()
+    _finish(returncode, stderr, output_path)
@@ -0,0 +1,333 @@
+"""
+Shared HTTP client for the scraper: one pooled requests.Session for all threads, with a per-host concurrency
+limit, a per-host rate limit and retries with exponential backoff on transient errors.
+"""
+
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from http_cache import NEGATIVE_STATUS_CODES
+
+logger = logging.getLogger()
+
+# Client defaults
+PER_HOST_CONCURRENCY = 4
+REQUESTS_PER_SECOND = None  # per host; None disables rate limiting
+RETRIES = 3
+BACKOFF_SECONDS = 0.5  # delay before the first retry, doubled for every further retry
+TIMEOUT_SECONDS = 30
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+TRANSIENT_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+PART_SUFFIX = ".part"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class IncompleteDownloadError(IOError):
+    """ The body of a download ended before its announced size """
+
+
+class ChecksumMismatchError(IOError):
+    """ A completed download does not match its expected checksum """
+
+
+class RetryableStatusError(Exception):
+    """ Internal: a download got a status in RETRY_STATUS_CODES """
+
+    def __init__(self, response):
+        super().__init__(response.status_code)
+        self.response = response
+
+
+def file_digest(file_path, algorithm="sha1"):
+    digest = hashlib.new(algorithm)
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _content_range_start(response):
+    """ First byte position from a 'Content-Range: bytes 100-199/1234' header, or None if there is none """
+    start = response.headers.get("Content-Range", "").partition(" ")[2].partition("-")[0]
+    return int(start) if start.isdigit() else None
+
+
+def _content_range_total(response):
+    """ Total size from a 'Content-Range: bytes 0-99/1234' (or 'bytes */1234') header, or None if unknown """
+    total = response.headers.get("Content-Range", "").rpartition("/")[2]
+    return int(total) if total.isdigit() else None
+
+
+class CachedResponse:
+    """
+    The parts of a requests.Response the scraper uses, for responses that may come from a ResponseCache.
+    from_cache is True when the body was not transferred again (a fresh entry, or a 304 Not Modified).
+    """
+
+    def __init__(self, url, status_code, headers, content, from_cache):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.from_cache = from_cache
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status_code} for url: {self.url}", response=self)
+
+
+class HttpClient:
+    """
+    Thread-safe HTTP client. Every request to a host waits for one of per_host_concurrency slots and, when
+    requests_per_second is set, for its turn under the host's rate limit.
+    Connection errors, timeouts and the status codes in RETRY_STATUS_CODES are retried up to retries times,
+    sleeping backoff_seconds * 2 ** attempt (plus jitter, or the server's Retry-After) in between.
+
+    url_overrides maps url prefixes to replacements, e.g. {"https://ted2srt.org": "http://127.0.0.1:8000"},
+    which points the scraper at a local stand-in server.
+    cache is an optional http_cache.ResponseCache used by get_cached().
+    """
+
+    def __init__(self, per_host_concurrency=PER_HOST_CONCURRENCY, requests_per_second=REQUESTS_PER_SECOND,
+                 retries=RETRIES, backoff_seconds=BACKOFF_SECONDS, timeout=TIMEOUT_SECONDS, url_overrides=None,
+                 cache=None):
+        self.per_host_concurrency = per_host_concurrency
+        self.min_interval = 1 / requests_per_second if requests_per_second else 0.0
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.url_overrides = dict(url_overrides or {})
+        self.cache = cache
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max(per_host_concurrency, 10))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._host_next_time = {}
+
+    def resolve(self, url):
+        """
+        Applies url_overrides to a url.
+        :param url: The url as built by the scraper.
+        :return: Returns the url to request.
+        """
+        for prefix, replacement in self.url_overrides.items():
+            if url.startswith(prefix):
+                return replacement + url[len(prefix):]
+        return url
+
+    @contextmanager
+    def host_slot(self, url):
+        """
+        Holds one of the host's concurrency slots, after waiting for the host's rate limit.
+        :param url: A resolved url.
+        """
+        host = urlsplit(url).netloc
+        with self._lock:
+            slot = self._host_slots.setdefault(host, threading.BoundedSemaphore(self.per_host_concurrency))
+        with slot:
+            if self.min_interval:
+                with self._lock:
+                    now = time.monotonic()
+                    start_time = max(now, self._host_next_time.get(host, now))
+                    self._host_next_time[host] = start_time + self.min_interval
+                time.sleep(max(0.0, start_time - now))
+            yield
+
+    def _retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff_seconds * 2 ** attempt * (1 + random.random() / 2)
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request with retries. The caller checks the final status, e.g. with raise_for_status().
+        Streamed responses (stream=True) hold no host slot while their body is read; see download() for that.
+        :param method: The HTTP method, e.g. "GET".
+        :param url: The url, before url_overrides.
+        :param kwargs: Passed on to requests.Session.request.
+        :return: Returns the requests.Response of the last attempt.
+        """
+        url = self.resolve(url)
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.retries + 1):
+            try:
+                with self.host_slot(url):
+                    response = self.session.request(method, url, **kwargs)
+            except TRANSIENT_EXCEPTIONS as exception:
+                if attempt == self.retries:
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"{method} <{url}> failed ({exception}), retrying in {delay:.1f}s...")
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.retries:
+                    return response
+                delay = self._retry_delay(attempt, response)
+                response.close()
+                logger.warning(f"{method} <{url}> returned {response.status_code}, retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def get_cached(self, url):
+        """
+        GET through the response cache. Fresh entries and live negative entries are answered without any request;
+        older entries are revalidated with a conditional request, and a 304 answer reuses the cached body.
+        Successful responses are stored, and 404/410 answers go to the negative cache.
+        Without a cache this is a plain get().
+        :param url: The url, before url_overrides; entries are keyed by it, so they survive a change of overrides.
+        :return: Returns a CachedResponse.
+        """
+        if self.cache is None:
+            response = self.get(url)
+            return CachedResponse(url, response.status_code, response.headers, response.content, from_cache=False)
+
+        entry = self.cache.lookup(url)
+        if entry is not None and self.cache.is_fresh(entry):
+            return self._from_cache(url, entry)
+
+        headers = self.cache.validators(entry) if entry is not None else {}
+        response = self.get(url, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            self.cache.touch(url, entry)
+            return self._from_cache(url, entry)
+        if response.status_code == 200 or response.status_code in NEGATIVE_STATUS_CODES:
+            self.cache.store(url, response.status_code, response.headers, response.content)
+        return CachedResponse(url, response.status_code, response.headers, response.content, from_cache=False)
+
+    def _from_cache(self, url, entry):
+        content = b"" if entry["negative"] else self.cache.body(url)
+        return CachedResponse(url, entry["status_code"], entry["headers"], content, from_cache=True)
+
+    def mark_negative(self, url):
+        """ Records in the cache, if any, that url has nothing to offer; see ResponseCache.mark_negative """
+        if self.cache is not None:
+            self.cache.mark_negative(url)
+
+    @contextmanager
+    def open_stream(self, url):
+        """
+        Opens a streamed GET response, holding a host slot until it is closed. Nothing is retried, since the body
+        is consumed by the caller.
+        :param url: The url, before url_overrides.
+        :return: Yields the requests.Response. Raises requests.HTTPError for an unsuccessful status.
+        """
+        url = self.resolve(url)
+        with self.host_slot(url), self.session.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            yield response
+
+    def download(self, url, file_path, checksum=None):
+        """
+        Downloads a url to a file in chunks, holding a host slot for the whole transfer.
+        Data is written to file_path + ".part" and renamed to file_path only once it is complete: its size matches
+        the Content-Length (or Content-Range total) and, when given, its checksum matches. A transfer that breaks
+        off is resumed from the end of the .part file with a Range request, both on retry and on a later call.
+        :param url: The url to download, before url_overrides.
+        :param file_path: The file to write to.
+        :param checksum: Optional "<hashlib algorithm>:<hex digest>", e.g. "sha1:1f09...".
+        :return: No return value. Raises requests.HTTPError for an unsuccessful status, IncompleteDownloadError
+                 when the retries run out before the file is complete and ChecksumMismatchError for a bad checksum.
+        """
+        url = self.resolve(url)
+        part_path = file_path + PART_SUFFIX
+        for attempt in range(self.retries + 1):
+            try:
+                with self.host_slot(url):
+                    self._download_part(url, part_path)
+                break
+            except RetryableStatusError as exception:
+                if attempt == self.retries:
+                    exception.response.raise_for_status()
+                delay = self._retry_delay(attempt, exception.response)
+                logger.warning(f"Download of <{url}> returned {exception.response.status_code}, retrying in {delay:.1f}s...")
+            except TRANSIENT_EXCEPTIONS + (IncompleteDownloadError,) as exception:
+                if attempt == self.retries:
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"Download of <{url}> failed ({exception}), resuming in {delay:.1f}s...")
+            time.sleep(delay)
+
+        if checksum:
+            algorithm, expected = checksum.split(":", 1)
+            actual = file_digest(part_path, algorithm)
+            if actual != expected.lower():
+                os.remove(part_path)
+                raise ChecksumMismatchError(f"{algorithm} of <{url}> is {actual}, expected {expected}")
+        os.replace(part_path, file_path)
+
+    def _download_part(self, url, part_path):
+        """
+        Fetches the rest of a url into part_path, continuing after the bytes already there.
+        A 206 whose Content-Range does not start there is only used if it starts at byte 0, replacing the file;
+        otherwise the file is discarded. Raises IncompleteDownloadError then, and when the body ends before the
+        expected size.
+        """
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code in RETRY_STATUS_CODES:
+                raise RetryableStatusError(response)
+            if response.status_code == 416:
+                # Nothing left to fetch: the .part file already holds the whole body, or it is not from this url
+                total = _content_range_total(response)
+                if total is not None and total == offset:
+                    return
+                os.remove(part_path)
+                raise IncompleteDownloadError(f"Stale partial download of <{url}> discarded")
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                start = _content_range_start(response)
+                if start != offset and start != 0:
+                    # appending this body would corrupt the file; the retry starts over without a Range header
+                    os.remove(part_path)
+                    raise IncompleteDownloadError(f"<{url}> answered bytes from {start} instead of {offset}, "
+                                                  f"partial download discarded")
+                total = _content_range_total(response)
+                mode = "ab" if start else "wb"
+                offset = start
+            else:  # the server ignored the Range header, start over
+                content_length = response.headers.get("Content-Length")
+                total = int(content_length) if content_length and "Content-Encoding" not in response.headers else None
+                offset, mode = 0, "wb"
+
+            with open(part_path, mode) as file:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+                    offset += len(chunk)
+
+        if total is not None and offset != total:
+            raise IncompleteDownloadError(f"Got {offset} of {total} bytes from <{url}>")
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
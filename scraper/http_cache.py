@@ -0,0 +1,113 @@
+"""
+Persistent cache of HTTP responses for talk pages and SRT transcripts.
+
+Each url is stored as '<sha1 of url>.json' (status, validators, time of the last check) next to '<sha1>.body'.
+Entries are revalidated with If-None-Match / If-Modified-Since, and urls known to have nothing to offer
+(a 404, or a talk page without metadata) are remembered in a negative cache until its TTL runs out.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+FRESH_SECONDS = 24 * 60 * 60  # entries checked this recently are used without asking the server
+NEGATIVE_TTL_SECONDS = 7 * 24 * 60 * 60
+NEGATIVE_STATUS_CODES = frozenset({404, 410})
+
+
+def _write_atomic(file_path, data):
+    # a temporary file per process and thread, so concurrent writers of one url never share one
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, file_path)
+
+
+class ResponseCache:
+    """
+    On-disk response cache, safe to share between threads of one process: entries are replaced atomically,
+    and two threads fetching the same url at worst both store it.
+    """
+
+    def __init__(self, cache_dir, fresh_seconds=FRESH_SECONDS, negative_ttl_seconds=NEGATIVE_TTL_SECONDS):
+        self.cache_dir = cache_dir
+        self.fresh_seconds = fresh_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+
+    def _path(self, url, suffix):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + suffix)
+
+    def lookup(self, url):
+        """
+        Gets the cache entry of a url.
+        :param url: The requested url.
+        :return: Returns a dict with 'url', 'status_code', 'headers', 'checked_at' and 'negative', or None when the
+                 url is not cached or its negative entry has expired.
+        """
+        try:
+            with open(self._path(url, ".json")) as file:
+                entry = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry["negative"] and time.time() - entry["checked_at"] > self.negative_ttl_seconds:
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        if entry["negative"]:
+            return True  # lookup() drops negative entries once they expire
+        return time.time() - entry["checked_at"] <= self.fresh_seconds
+
+    def body(self, url):
+        with open(self._path(url, ".body"), "rb") as file:
+            return file.read()
+
+    def validators(self, entry):
+        """
+        Conditional request headers for revalidating an entry.
+        :param entry: An entry returned by lookup().
+        :return: Returns a dict of headers, empty when the entry has no ETag or Last-Modified.
+        """
+        headers = {}
+        if entry["headers"].get("ETag"):
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if entry["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        return headers
+
+    def store(self, url, status_code, headers, body):
+        """
+        Stores a response. Statuses in NEGATIVE_STATUS_CODES are stored as negative entries.
+        :param url: The requested url.
+        :param status_code: The response status.
+        :param headers: The response headers; only the validators and the content type are kept.
+        :param body: The response body as bytes.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        kept_headers = {name: headers[name] for name in ("ETag", "Last-Modified", "Content-Type") if name in headers}
+        _write_atomic(self._path(url, ".body"), body)
+        self._write_entry(url, status_code, kept_headers, negative=status_code in NEGATIVE_STATUS_CODES)
+
+    def mark_negative(self, url):
+        """
+        Remembers that a url has nothing to offer, e.g. a talk page without metadata, until the negative TTL runs out.
+        Marking a url that is already negative keeps its time of check, so the TTL counts from the last time the
+        server was asked and repeated sweeps do not keep extending it.
+        :param url: The requested url.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = self.lookup(url)
+        if entry is not None and entry["negative"]:
+            return
+        self._write_entry(url, entry["status_code"] if entry else 404, entry["headers"] if entry else {}, negative=True)
+
+    def touch(self, url, entry):
+        """ Records that an entry was revalidated just now """
+        self._write_entry(url, entry["status_code"], entry["headers"], entry["negative"])
+
+    def _write_entry(self, url, status_code, headers, negative):
+        entry = {"url": url, "status_code": status_code, "headers": headers, "checked_at": time.time(),
+                 "negative": negative}
+        _write_atomic(self._path(url, ".json"), json.dumps(entry).encode("utf-8"))
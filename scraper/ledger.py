@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+
+LEDGER_FILE_NAME = '.ledger.json'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha1(file_path):
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def params_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class Ledger:
+    """
+    Persisted record of the talks preprocess.convert has already processed, stored as .ledger.json in the output folder.
+    Each talk keeps its output id, the sha1 of its source files and the hash of the preprocessing parameters,
+    so a rerun only redoes talks that are new, changed or processed with other parameters.
+    Talks are recorded only once their output is complete, and the ledger is saved atomically, so an
+    interrupted run resumes after the last save; preprocess.TalkOutput deletes the output of unrecorded talks.
+    """
+
+    def __init__(self, output_root):
+        self.ledger_path = os.path.join(output_root, LEDGER_FILE_NAME)
+        self.talks = {}
+        self.next_id = 0
+        if os.path.isfile(self.ledger_path):
+            with open(self.ledger_path) as f:
+                ledger = json.load(f)
+            self.talks = ledger['talks']
+            self.next_id = ledger['next_id']
+        self._known_sources = {path: source for entry in self.talks.values() for path, source in entry['sources'].items()}
+
+    def fingerprint(self, source_files):
+        """
+        {file name: {'size', 'mtime_ns', 'sha1'}} for the source files of a talk.
+        Files whose size and mtime match the ledger reuse the recorded hash instead of being read again.
+        """
+        fingerprint = {}
+        for file_path in source_files:
+            file_path = os.path.abspath(file_path)
+            stat = os.stat(file_path)
+            source = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            previous = self._known_sources.get(file_path)
+            if previous and previous['size'] == source['size'] and previous['mtime_ns'] == source['mtime_ns']:
+                source['sha1'] = previous['sha1']
+            else:
+                source['sha1'] = file_sha1(file_path)
+            fingerprint[file_path] = source
+        return fingerprint
+
+    def is_current(self, talk, fingerprint, params):
+        entry = self.talks.get(talk)
+        if entry is None or entry['params'] != params_hash(params):
+            return False
+        recorded = {path: source['sha1'] for path, source in entry['sources'].items()}
+        return recorded == {path: source['sha1'] for path, source in fingerprint.items()}
+
+    def talk_id(self, talk):
+        """ Stable output id of a talk; new talks get the next free id """
+        if talk in self.talks:
+            return self.talks[talk]['id']
+        talk_id = str(self.next_id)
+        self.next_id += 1
+        return talk_id
+
+    def record(self, talk, talk_id, fingerprint, params, status, quality=None):
+        """ status is 'done' or 'rejected'; quality is the talk's subtitle quality report """
+        self.talks[talk] = {'id': talk_id, 'sources': fingerprint, 'params': params_hash(params), 'status': status,
+                            'quality': quality or {}}
+        self._known_sources.update(fingerprint)
+
+    def remove(self, talk):
+        return self.talks.pop(talk, None)
+
+    def save(self):
+        """ Only ids of recorded talks are kept: ids handed out to talks that were never recorded are free again """
+        os.makedirs(os.path.dirname(self.ledger_path), exist_ok=True)
+        next_id = max((int(entry['id']) + 1 for entry in self.talks.values()), default=0)
+        tmp_path = self.ledger_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'next_id': next_id, 'talks': self.talks}, f)
+        os.replace(tmp_path, self.ledger_path)
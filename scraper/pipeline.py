@@ -0,0 +1,223 @@
+'''
+Ingestion pipeline: scraping and preprocessing as concurrent stages instead of two phases.
+
+    download -> parse -> decode -> check -> slice -> write
+
+Stages are connected by bounded queues, so a fast stage blocks once the queue to the next one is full
+(backpressure) and at most a few talks are held in memory between two stages. Talk N is sliced while
+talk N+1 is still downloading.
+Every stage counts its items and busy time, and the depth of its input queue is sampled, so the slowest
+stage shows up as the one with the highest utilization and a full input queue.
+'''
+
+import logging
+import os
+import queue
+import threading
+import time
+
+from pydub import AudioSegment
+
+import scraper
+from preprocess import AUDIO_EXTENSION, TalkOutput, check_transcript, slice_talk, talk_sources, txt_to_trans
+
+logger = logging.getLogger(__name__) # named, as preprocess disables the root logger
+
+QUEUE_SIZE = 4 # talks waiting between two stages
+DOWNLOAD_WORKERS = 4
+SLICE_WORKERS = 2
+REPORT_INTERVAL = 10 # seconds between progress reports
+
+_STOP = object()
+
+
+class Stage:
+    '''
+    workers threads applying function to the items of in_queue and putting the results on out_queue.
+    function returns None to drop an item; an item that raises is logged and dropped.
+    The last worker to finish passes the end of the stream on to out_queue.
+    '''
+
+    def __init__(self, name, function, in_queue, out_queue=None, workers=1):
+        self.name = name
+        self.function = function
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.workers = workers
+        self.items_in = 0
+        self.items_out = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.depth_samples = []
+        self._lock = threading.Lock()
+        self._running = workers
+        self._threads = [threading.Thread(target=self._run, name=f'{name}-{i}', daemon=True) for i in range(workers)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def is_alive(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def _run(self):
+        while True:
+            item = self.in_queue.get()
+            if item is _STOP:
+                self.in_queue.put(_STOP) # for the other workers of this stage
+                break
+            start = time.perf_counter()
+            try:
+                result = self.function(item)
+            except Exception:
+                logger.exception(f'{self.name}: failed on {item!r:.200}')
+                result = None
+                with self._lock:
+                    self.errors += 1
+            with self._lock:
+                self.items_in += 1
+                self.busy_seconds += time.perf_counter() - start
+            if result is not None and self.out_queue is not None:
+                self.out_queue.put(result) # blocks while the next stage is behind
+                with self._lock:
+                    self.items_out += 1
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if last and self.out_queue is not None:
+            self.out_queue.put(_STOP)
+
+    def sample_depth(self):
+        self.depth_samples.append(self.in_queue.qsize())
+
+    def stats(self, elapsed):
+        '''
+        items, items/s over the pipeline's wall time, busy seconds, utilization (busy share of the stage's
+        worker time) and the mean / max depth of the input queue
+        '''
+        samples = self.depth_samples or [0]
+        return {
+            'workers': self.workers,
+            'items': self.items_in,
+            'passed': self.items_out,
+            'errors': self.errors,
+            'items_per_sec': self.items_in / elapsed if elapsed else 0.0,
+            'busy_seconds': self.busy_seconds,
+            'utilization': self.busy_seconds / (elapsed * self.workers) if elapsed else 0.0,
+            'mean_queue_depth': sum(samples) / len(samples),
+            'max_queue_depth': max(samples),
+        }
+
+
+def ingest(urls, output_format='shards', audio_format='wav', download_workers=DOWNLOAD_WORKERS,
+           slice_workers=SLICE_WORKERS, queue_size=QUEUE_SIZE, client=None, rebuild=False):
+    '''
+    Scrape the talks at urls and write their utterances to the preprocess output (preprocess.path / split),
+    with every stage running concurrently.
+    download: scraper.scrape_data_from_srt_url, transcript and audio track of a talk
+    parse: ledger lookup (talks whose sources are unchanged are skipped) and the srt transcript
+    decode: the talk audio
+    check: subtitle quality checks; rejected talks go straight to write
+    slice: conversion to the training format and encoding of the slices (or the talk folder, for 'files')
+    write: shards / ledger / language model text, in the order talks finish
+    The output and ledger are the same as preprocess.convert, which can run over the same folder afterwards.
+    Threads are enough here: downloads wait on the network, and decoding and encoding run in ffmpeg and C code.
+    return the stats of every stage, by stage name
+    '''
+    output = TalkOutput(output_format, audio_format, rebuild)
+
+    def download(url):
+        return scraper.scrape_data_from_srt_url(url, client)
+
+    def parse(talk_path):
+        plan = output.plan(talk_path)
+        if plan is None:
+            logger.info(f'{os.path.basename(talk_path)} unchanged, skipping')
+            return None
+        output_path, talk_id, fingerprint = plan
+        txt_path, audio_path = talk_sources(talk_path)
+        transcript, time_slices, txt_src = txt_to_trans(txt_path, talk_id)
+        return {'talk_path': talk_path, 'output_path': output_path, 'talk_id': talk_id, 'fingerprint': fingerprint,
+                'audio_path': audio_path, 'transcript': transcript, 'time_slices': time_slices, 'txt_src': txt_src}
+
+    def decode(talk):
+        talk['audio'] = AudioSegment.from_file(talk['audio_path'], AUDIO_EXTENSION)
+        return talk
+
+    def check(talk):
+        talk['report'] = check_transcript(talk['transcript'], talk['time_slices'], talk['audio'].duration_seconds)
+        if talk['report']['rejected']:
+            del talk['audio']
+        return talk
+
+    def slice_(talk):
+        if not talk['report']['rejected']:
+            talk['utterances'] = slice_talk(talk.pop('audio'), talk['transcript'], talk['time_slices'],
+                                            talk['output_path'], talk['talk_id'], os.path.basename(talk['talk_path']),
+                                            output_format, audio_format)
+        return talk
+
+    def write(talk):
+        curr_folder = os.path.basename(talk['talk_path'])
+        if talk['report']['rejected']:
+            logger.warning(f"{talk['talk_id']}. Srt failed checks {talk['report']['reasons']}. Deleting entry {curr_folder}")
+            result = (talk['report'], None, None)
+        else:
+            result = (talk['report'], talk['txt_src'], talk['utterances'])
+        if output.commit(curr_folder, talk['talk_id'], talk['fingerprint'], result):
+            logger.info(f"Successfully created {talk['talk_id']} {curr_folder}")
+        output.save()
+        return None
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(6)]
+    queues[0] = queue.Queue() # the url list itself is not bounded
+    stages = [
+        Stage('download', download, queues[0], queues[1], download_workers),
+        Stage('parse', parse, queues[1], queues[2]), # one worker: the ledger hands out talk ids
+        Stage('decode', decode, queues[2], queues[3], slice_workers),
+        Stage('check', check, queues[3], queues[4]),
+        Stage('slice', slice_, queues[4], queues[5], slice_workers),
+        Stage('write', write, queues[5]), # one worker: shards and ledger are written in one place
+    ]
+    for url in urls:
+        queues[0].put(url)
+    queues[0].put(_STOP)
+
+    start = time.perf_counter()
+    for stage in stages:
+        stage.start()
+    last_report = start
+    while any(stage.is_alive() for stage in stages):
+        time.sleep(0.1)
+        for stage in stages:
+            stage.sample_depth()
+        if time.perf_counter() - last_report >= REPORT_INTERVAL:
+            last_report = time.perf_counter()
+            logger.info('pipeline: ' + ', '.join(f'{stage.name} {stage.items_in} done / {stage.in_queue.qsize()} queued'
+                                                 for stage in stages))
+    for stage in stages:
+        stage.join()
+    output.finish()
+
+    elapsed = time.perf_counter() - start
+    stats = {stage.name: stage.stats(elapsed) for stage in stages}
+    logger.info(f'pipeline finished in {elapsed:.1f}s')
+    for name, stage_stats in stats.items():
+        logger.info(f"{name:>8}: {stage_stats['items']:5d} items ({stage_stats['errors']} failed) {stage_stats['items_per_sec']:7.2f}/s  "
+                    f"utilization {stage_stats['utilization']:5.0%}  "
+                    f"queue mean {stage_stats['mean_queue_depth']:4.1f} max {stage_stats['max_queue_depth']}")
+    return stats
+
+
+def main(number_of_talks=200, starting_video_id=100):
+    video_urls = scraper.generate_all_srt_video_urls(scraper.TED_SRT_TALKPAGE, number_of_talks,
+                                                     starting_video_id=starting_video_id)
+    ingest(video_urls)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,34 @@
+import io
+import json
 import os
+import sys
 from joblib import Parallel, delayed
 from os.path import join
 from pathlib import Path
 import shutil
 
 import scraper
+from ledger import Ledger
+from subtitles import iter_srt_cues
+from quality import check_talk, DURATION_DIFF, REPEATED_OCCURRENCE
 import re
 import subprocess
-import num2words
+import threading
 import pydub
 from pydub import AudioSegment
+import numpy as np
+import torch
 from tqdm import tqdm
 import logging
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # repo root, for utils
+from utils.shards import ShardWriter
+from utils.features import resampler
+from utils.normalize import normalize_corpus, NORMALIZATION_VERSION
 
 logger = logging.getLogger()
 # logging.basicConfig(level="INFO", format="%(levelname)s: %(filename)s: %(message)s")
@@ -20,29 +37,17 @@ logger = logging.getLogger()
 logger.disabled = True
 
 AUDIO_EXTENSION = 'mp3'
+OUTPUT_SAMPLE_RATE = 16000 # training format for audio_format 'wav' / 'flac'
+OUTPUT_CHANNELS = 1
+RESAMPLE_VERSION = 2 # 1: pydub linear interpolation, 2: band-limited sinc (utils.features.resampler); part of the ledger params
 READ_FILE_THREADS = 1
 path = '../data/TedSrt'
 split = 'train'
+txt_src_path = join(path, 'txt_src.txt') # cleaned sentences for language model training
 
 src_path = 'data'
 
 
-DURATION_DIFF = 7 # seconds
-REPEATED_OCCURRENCE = 50
-
-def clean_text(text):
-    '''
-    Text processing to clean text before saving as label
-    to lowercase, convert years to words, convert digits to words, remove symbols
-    '''
-    text = text.lower().strip('\n')
-    text = re.sub(r'[^\w\s]', ' ', text)
-    text = ' '.join([num2words.num2words(i, to='year') if (i.isdigit() & (len(i) == 4)) else i for i in text.split()]) # year to words
-    text = ' '.join([num2words.num2words(i) if i.isdigit() else i for i in text.split()]) # num to words
-    text = re.sub(' +', ' ', text) # remove redundant spaces
-    text = text.replace('-', ' ')
-    return text
-
 def normalize_text(text):
     '''
     Text processing to normalize text for language model training
@@ -54,50 +59,29 @@ def normalize_text(text):
     text = text.replace('-', ' ')
     return text
 
-def to_ms(string):
-    '''
-    Convert string '00:00:00,000' to milliseconds
-    to be used for audio slicing
-    '''
-    string = string.replace(',','')
-    hour, minute, second = string.split(':')
-    second = int(second)
-    second += int(hour) * 3600 * 1000
-    second += int(minute) * 60 * 1000
-    second = second
-    return second
-
 def txt_to_trans(txt_file, file_name):
     '''
     Convert txt file to transcript format ready to be read into Dataset
     lines formatted as 'filename-idx text_label'
+    cues are read by subtitles.iter_srt_cues, keeping every line of multi-line captions,
+    and their labels cleaned in one utils.normalize.normalize_corpus call
     return lines and time_slices
     '''
-    file = open(txt_file, 'r')
-    lines = file.readlines()
-    file.close()
-    
     transcript = [] # label for audio
     txt_src = [] # label for language model
     time_slices = []
 
-    for i in range(len(lines)):
-        idx = re.search('^[\d]+$', lines[i].strip('\ufeff'))
-        if idx:
-            idx = idx[0]
-            time_frame = re.findall('[0-9]{2}:[0-9]{2}:[0-9]{2},[0-9]{3}', lines[i+1])
-            if time_frame:
-                start, end = to_ms(time_frame[0]), to_ms(time_frame[1])
-                time_slices.append((idx, (start, end)))
-
-                audio_label = lines[i+2]
-                audio_label = clean_text(audio_label)
-                new_line = f"{file_name}-{idx} {audio_label}"
-                transcript.append(new_line)
-                
-                lm_label = normalize_text(audio_label)
-                txt_src.append(lm_label)
-                
+    cues = list(iter_srt_cues(txt_file))
+    audio_labels = normalize_corpus([text for _, _, _, text in cues])
+    for (idx, start, end, _), audio_label in zip(cues, audio_labels):
+        time_slices.append((idx, (start, end)))
+
+        new_line = f"{file_name}-{idx} {audio_label}"
+        transcript.append(new_line)
+
+        lm_label = normalize_text(audio_label)
+        txt_src.append(lm_label)
+
     return transcript, time_slices, txt_src
 
 def save_trans(transcript, output_path):
@@ -112,62 +96,292 @@ def save_trans(transcript, output_path):
             f.write(f"{line}\n")
         f.close()
 
-def check_ms_accuracy(time_slices, occurrence_threshold=20):
-    for time_slice in time_slices:
-        occurrence_820 = sum(1 for elem in time_slices if elem[1][0] % 1000 == 820)
-    if occurrence_820 > REPEATED_OCCURRENCE:
-        return occurrence_820
-    return 0
-
-def check_intro_timing(audio_duration, audio_srt_duration):
-    duration_diff = audio_duration - audio_srt_duration
-    if duration_diff > DURATION_DIFF:
-        return duration_diff
-    return 0
-
-def convert(src_path=src_path):
-    shutil.rmtree(join(path, split), ignore_errors=True)
-    folder_list = os.listdir(src_path)
-    for idx, curr_folder in enumerate(tqdm(folder_list, desc="Looping over folders")):
-        logging.info('\n')
-        file_name = str(idx) #save the transcript as num, can be changed to folder name
-        output_path = join(path, split, file_name)
-        txt_output_path = join(output_path, file_name + '.trans.txt')
-        
-        logging.info(f"{idx}. Creating transcript for {curr_folder}...")
-        txt_path = list(Path(join(src_path, curr_folder)).rglob('*.txt'))[0]
-        transcript, time_slices, txt_src = txt_to_trans(txt_path, file_name)
-        
-        logging.info(f"{idx}. Slicing audio for {curr_folder}...")
-        audio_path = list(Path(join(src_path, curr_folder)).rglob('*.' + AUDIO_EXTENSION))[0]
-        audio_file = AudioSegment.from_file(audio_path, AUDIO_EXTENSION)
-        
-        # check whether srt is accurate, remove those not accurate to milliseconds, check repeated occurrence of 820
-        ms_not_accurate = check_ms_accuracy(time_slices)
-        if ms_not_accurate:
-            logging.warning(f"{idx}. Srt not accurate with {ms_not_accurate} 820s. Deleting entry {curr_folder}")
-            shutil.rmtree(output_path, ignore_errors=True)
-            continue
-        
-        # check whether srt matches audio, remove those without taking water drop intro into account
-        audio_duration = audio_file.duration_seconds
-        audio_srt_duration = time_slices[-1][-1][-1] / 1000
-        intro_not_matched = check_intro_timing(audio_duration, audio_srt_duration)
-        if intro_not_matched:
-            logging.warning(f"{idx}. Srt not matching with time slices. Deleting entry {curr_folder}")
-            shutil.rmtree(output_path, ignore_errors=True)
+def to_training_format(audio_file):
+    '''
+    Downmix and resample a whole talk once to the training format, 16 kHz mono int16
+    Resampling uses the band-limited kernel the dataset resamples with; pydub's set_frame_rate interpolates
+    linearly without a low-pass filter and folds everything above 8 kHz back into the band
+    '''
+    full_scale = float(1 << (8 * audio_file.sample_width - 1))
+    samples = np.array(audio_file.get_array_of_samples(), dtype=np.float32).reshape(-1, audio_file.channels)
+    waveform = torch.from_numpy(samples.mean(axis=1) / full_scale).unsqueeze(0)
+    if audio_file.frame_rate != OUTPUT_SAMPLE_RATE:
+        waveform = resampler(audio_file.frame_rate, OUTPUT_SAMPLE_RATE)(waveform)
+    samples = torch.round(waveform[0] * 32768).clamp_(-32768, 32767).to(torch.int16).numpy()
+    return AudioSegment(samples.tobytes(), frame_rate=OUTPUT_SAMPLE_RATE, sample_width=2, channels=OUTPUT_CHANNELS)
+
+def export_slice(audio_slice, audio_format=AUDIO_EXTENSION):
+    '''
+    Encode an audio slice in memory and return the bytes
+    wav is written by pydub directly and flac by soundfile when installed, without spawning an encoder per slice
+    '''
+    buffer = io.BytesIO()
+    if audio_format == 'flac' and soundfile is not None:
+        samples = np.frombuffer(audio_slice.raw_data, dtype=np.int16).reshape(-1, audio_slice.channels)
+        soundfile.write(buffer, samples, audio_slice.frame_rate, format='FLAC', subtype='PCM_16')
+    else:
+        audio_slice.export(buffer, format=audio_format)
+    return buffer.getvalue()
+
+def talk_sources(talk_path):
+    '''
+    Return the (srt transcript, audio) files of a talk folder
+    '''
+    txt_path = list(Path(talk_path).rglob('*.txt'))[0]
+    audio_path = list(Path(talk_path).rglob('*.' + AUDIO_EXTENSION))[0]
+    return txt_path, audio_path
+
+def check_transcript(transcript, time_slices, audio_duration):
+    '''
+    All subtitle checks in one pass: repeated 820 ms starts (srt not accurate to milliseconds), srt not matching
+    the audio duration (water drop intro), overlaps, empty cues, gaps and characters per second
+    return the quality report of quality.check_talk
+    '''
+    label_texts = [line.split(' ', 1)[1] for line in transcript]
+    return check_talk(time_slices, audio_duration, label_texts)
+
+def slice_talk(audio_file, transcript, time_slices, output_path, file_name, curr_folder, output_format='files', audio_format=AUDIO_EXTENSION):
+    '''
+    Write the transcript and audio slices of a talk that passed the checks.
+    audio_format 'wav' / 'flac' converts the talk once to 16 kHz mono int16 before slicing,
+    instead of re-encoding every slice to mp3
+    'files': the talk folder is written under a hidden temporary name and renamed into place,
+    so a crash never leaves a half-written folder behind
+    'shards': the encoded utterances are returned, for the caller to pack in talk order
+    return the list of (key, audio bytes, label, meta) utterances, empty for 'files'
+    '''
+    if audio_format != AUDIO_EXTENSION:
+        audio_file = to_training_format(audio_file)
+    utterances = []
+    if output_format == 'shards':
+        labels = dict(line.split(' ', 1) for line in transcript)
+        for slice_idx, time_slice in time_slices:
+            key = f"{file_name}-{slice_idx}"
+            audio_bytes = export_slice(audio_file[time_slice[0]:time_slice[1]], audio_format)
+            meta = {'talk': curr_folder, 'start_ms': time_slice[0], 'end_ms': time_slice[1]}
+            utterances.append((key, audio_bytes, labels[key], meta))
+        return utterances
+
+    tmp_output_path = join(os.path.dirname(output_path), f'.{file_name}.tmp')
+    shutil.rmtree(tmp_output_path, ignore_errors=True)
+    save_trans(transcript, join(tmp_output_path, file_name + '.trans.txt'))
+    for slice_idx, time_slice in time_slices:
+        audio_slice = audio_file[time_slice[0]:time_slice[1]]
+        audio_output_path = join(tmp_output_path, f"{file_name}-{slice_idx}.{audio_format}")
+        with open(audio_output_path, 'wb') as f:
+            f.write(export_slice(audio_slice, audio_format))
+    shutil.rmtree(output_path, ignore_errors=True)
+    os.replace(tmp_output_path, output_path)
+    return utterances
+
+def process_talk(talk_path, output_path, file_name, output_format='files', audio_format=AUDIO_EXTENSION):
+    '''
+    Create the transcript and audio slices of one talk folder.
+    Talks never depend on each other, so this runs in worker processes.
+    return (quality report, txt_src, utterances); txt_src and utterances are None if the talk fails a check
+    '''
+    curr_folder = os.path.basename(talk_path)
+    txt_path, audio_path = talk_sources(talk_path)
+    logging.info(f"{file_name}. Creating transcript for {curr_folder}...")
+    transcript, time_slices, txt_src = txt_to_trans(txt_path, file_name)
+    
+    logging.info(f"{file_name}. Slicing audio for {curr_folder}...")
+    audio_file = AudioSegment.from_file(audio_path, AUDIO_EXTENSION)
+    
+    report = check_transcript(transcript, time_slices, audio_file.duration_seconds)
+    if report['rejected']:
+        logging.warning(f"{file_name}. Srt failed checks {report['reasons']}. Deleting entry {curr_folder}")
+        shutil.rmtree(output_path, ignore_errors=True)
+        return report, None, None
+    
+    # writing output
+    utterances = slice_talk(audio_file, transcript, time_slices, output_path, file_name, curr_folder, output_format, audio_format)
+    return report, txt_src, utterances
+
+class TalkOutput:
+    '''
+    The output folder of convert and the ingestion pipeline: talk folders or shards, the per-talk language model
+    sentences, the ledger of processed talks, quality_report.jsonl and txt_src_path.
+    Thread-safe: the ledger and the output are only touched under one lock, so plan() and commit() can run in
+    different threads, as in the ingestion pipeline.
+    '''
+
+    def __init__(self, output_format='files', audio_format=AUDIO_EXTENSION, rebuild=False):
+        self.output_format = output_format
+        self.audio_format = audio_format
+        self.output_root = join(path, split)
+        self.lm_root = join(self.output_root, '.lm') # per-talk sentences, joined into txt_src_path at the end
+        if rebuild:
+            shutil.rmtree(self.output_root, ignore_errors=True)
+        os.makedirs(self.lm_root, exist_ok=True)
+        self.ledger = Ledger(self.output_root)
+        self.params = {'audio_extension': AUDIO_EXTENSION, 'output_format': output_format, 'audio_format': audio_format,
+                       'sample_rate': OUTPUT_SAMPLE_RATE, 'channels': OUTPUT_CHANNELS,
+                       'duration_diff': DURATION_DIFF, 'repeated_occurrence': REPEATED_OCCURRENCE,
+                       'normalization': NORMALIZATION_VERSION, 'resample': RESAMPLE_VERSION}
+        # in shard mode a talk is only recorded once the shard holding it is complete
+        self.pending_talks = {}
+        self.shard_writer = ShardWriter(self.output_root, on_shard_closed=self._record_shard_talks) if output_format == 'shards' else None
+        self._lock = threading.RLock()
+        self._drop_unrecorded()
+
+    def _drop_unrecorded(self):
+        '''
+        Delete the output an interrupted run wrote for talks it never recorded in the ledger: talk folders renamed
+        into place (or shard entries) before their commit, half-written .<id>.tmp folders and language model
+        files. The ledger hands their ids out again, so they would otherwise end up in the data twice.
+        '''
+        recorded = {entry['id'] for entry in self.ledger.talks.values()}
+        for name in os.listdir(self.output_root):
+            talk_id = name[1:-len('.tmp')] if name.startswith('.') and name.endswith('.tmp') else name
+            if talk_id.isdigit() and talk_id not in recorded and os.path.isdir(join(self.output_root, name)):
+                logging.info(f"Deleting {name}, the output of an interrupted run")
+                shutil.rmtree(join(self.output_root, name))
+        for name in os.listdir(self.lm_root):
+            if name[:-len('.txt')] not in recorded:
+                os.remove(join(self.lm_root, name))
+        if self.shard_writer:
+            unrecorded = {talk_id for shard in self.shard_writer.shards for talk_id in shard['talks']} - recorded
+            if unrecorded - self.shard_writer.retired:
+                self.shard_writer.retire(sorted(unrecorded))
+
+    def _record_shard_talks(self, talk_ids):
+        for talk_id in talk_ids:
+            if talk_id in self.pending_talks:
+                curr_folder, fingerprint, report = self.pending_talks.pop(talk_id)
+                self.ledger.record(curr_folder, talk_id, fingerprint, self.params, 'done', report)
+        self.ledger.save()
+
+    def drop_output(self, talk_id):
+        os.makedirs(self.lm_root, exist_ok=True)
+        if os.path.isfile(join(self.lm_root, talk_id + '.txt')):
+            os.remove(join(self.lm_root, talk_id + '.txt'))
+        if self.shard_writer:
+            self.shard_writer.retire([talk_id])
+        else:
+            shutil.rmtree(join(self.output_root, talk_id), ignore_errors=True)
+
+    def remove_missing(self, folder_list):
+        '''
+        Delete the output of ledger talks that are not in folder_list anymore
+        '''
+        with self._lock:
+            self._remove_missing(folder_list)
+
+    def _remove_missing(self, folder_list):
+        for curr_folder in set(self.ledger.talks) - set(folder_list):
+            logging.info(f"{curr_folder} was removed from its source folder. Deleting its output...")
+            self.drop_output(self.ledger.remove(curr_folder)['id'])
+        self.ledger.save()
+
+    def plan(self, talk_path):
+        '''
+        return (output_path, talk_id, fingerprint) for a talk folder to process, or None if its output is current
+        '''
+        curr_folder = os.path.basename(talk_path)
+        with self._lock:
+            fingerprint = self.ledger.fingerprint(talk_sources(talk_path))
+            if self.ledger.is_current(curr_folder, fingerprint, self.params):
+                return None
+            talk_id = self.ledger.talk_id(curr_folder) #save the transcript as num, can be changed to folder name
+        return join(self.output_root, talk_id), talk_id, fingerprint
+
+    def commit(self, curr_folder, talk_id, fingerprint, result):
+        '''
+        Write the result of process_talk to the output and the ledger; return False if the talk was rejected
+        '''
+        with self._lock:
+            return self._commit(curr_folder, talk_id, fingerprint, result)
+
+    def _commit(self, curr_folder, talk_id, fingerprint, result):
+        report, txt_src, utterances = result
+        if report['rejected']:
+            self.drop_output(talk_id)
+            self.ledger.record(curr_folder, talk_id, fingerprint, self.params, 'rejected', report)
+            return False
+        with open(join(self.lm_root, talk_id + '.txt'), 'w') as f:
+            f.writelines(f"{line}\n" for line in txt_src)
+        if self.shard_writer:
+            for key, audio_bytes, label, meta in utterances:
+                self.shard_writer.write(key, audio_bytes, self.audio_format, label, meta, talk=talk_id)
+            self.pending_talks[talk_id] = (curr_folder, fingerprint, report)
+        else:
+            self.ledger.record(curr_folder, talk_id, fingerprint, self.params, 'done', report)
+        return True
+
+    def save(self):
+        with self._lock:
+            self.ledger.save()
+
+    def finish(self):
+        '''
+        Close the last shard and write quality_report.jsonl and txt_src_path
+        '''
+        with self._lock:
+            self._finish()
+
+    def _finish(self):
+        if self.shard_writer:
+            self.shard_writer.close()
+        self.ledger.save()
+
+        with open(join(self.output_root, 'quality_report.jsonl'), 'w') as f:
+            for curr_folder, entry in sorted(self.ledger.talks.items(), key=lambda item: int(item[1]['id'])):
+                f.write(json.dumps({'talk': curr_folder, 'id': entry['id'], 'status': entry['status'], **entry['quality']}) + '\n')
+
+        # rewrite the language model text from the per-talk files, so reruns never duplicate sentences
+        done_ids = sorted((int(entry['id']) for entry in self.ledger.talks.values() if entry['status'] == 'done'))
+        with open(txt_src_path, 'w') as f:
+            for talk_id in done_ids:
+                with open(join(self.lm_root, f'{talk_id}.txt')) as lm_file:
+                    shutil.copyfileobj(lm_file, f)
+
+def convert(src_path=src_path, output_format='files', workers=READ_FILE_THREADS, audio_format=AUDIO_EXTENSION, rebuild=False):
+    '''
+    output_format 'files': one audio file per subtitle line plus a .trans.txt per talk folder
+    output_format 'shards': utterances (audio, cleaned label, metadata) packed into large tar shards
+    with an index.json, to be streamed by dataset.ShardDataset
+    audio_format 'mp3' keeps the source rate and re-encodes every slice; 'wav' / 'flac' write 16 kHz mono
+    int16 slices that are cheaper to write and many times faster to decode in training
+    workers > 1 processes talks in a process pool. Results are written in sorted folder order,
+    so the output does not depend on which talk finishes first
+    Processed talks are kept in a ledger (.ledger.json): a rerun skips talks whose sources and parameters are
+    unchanged, redoes changed ones, drops removed ones and resumes after an interruption.
+    rebuild=True deletes the output and starts from scratch
+    The subtitle quality statistics of every talk are written to quality_report.jsonl in the output folder
+    '''
+    output = TalkOutput(output_format, audio_format, rebuild)
+    folder_list = sorted(os.listdir(src_path))
+    output.remove_missing(folder_list)
+
+    jobs, fingerprints = [], []
+    for curr_folder in folder_list:
+        talk_path = join(src_path, curr_folder)
+        plan = output.plan(talk_path)
+        if plan is None:
             continue
-        
-        # writing output
-        save_trans(transcript, txt_output_path)
-        save_trans(txt_src, txt_src_path)
-        for idx, time_slice in time_slices:
-            audio_slice = audio_file[time_slice[0]:time_slice[1]]
-            audio_output_path = join(output_path, f"{file_name}-{idx}.{AUDIO_EXTENSION}")
-            audio_slice.export(audio_output_path, format=AUDIO_EXTENSION)
-        
-        tqdm.write(f'Successfully created {idx} {curr_folder}')
-        # print(f'Successfully created {idx} {curr_folder}')
+        output_path, talk_id, fingerprint = plan
+        jobs.append((talk_path, output_path, talk_id, output_format, audio_format))
+        fingerprints.append(fingerprint)
+    logging.info(f"{len(folder_list) - len(jobs)} talks unchanged, {len(jobs)} to process")
+
+    with Parallel(n_jobs=workers, return_as='generator') as parallel, tqdm(total=len(jobs), desc="Looping over folders") as pbar:
+        # results arrive in job order as soon as each talk is done; joblib only dispatches a few talks ahead,
+        # which bounds how many finished talks are held in memory at once
+        if workers > 1:
+            results = parallel(delayed(process_talk)(*job) for job in jobs)
+        else:
+            results = (process_talk(*job) for job in jobs)
+
+        for (talk_path, _, file_name, _, _), fingerprint, result in zip(jobs, fingerprints, results):
+            pbar.update()
+            curr_folder = os.path.basename(talk_path)
+            if output.commit(curr_folder, file_name, fingerprint, result):
+                tqdm.write(f'Successfully created {file_name} {curr_folder}')
+            # print(f'Successfully created {idx} {curr_folder}')
+            output.save()
+
+    output.finish()
 
 def main():
     # print('Scraping data')
@@ -0,0 +1,63 @@
+"""
+Subtitle quality checks for a talk, computed in one vectorized pass over its cue timings.
+"""
+
+import numpy as np
+
+# Rejection thresholds
+REPEATED_MS_VALUE = 820  # Millisecond value that badly aligned TED2SRT subtitles repeat
+REPEATED_OCCURRENCE = 50  # Reject when more cue starts than this end in REPEATED_MS_VALUE
+DURATION_DIFF = 7  # seconds; reject when the audio runs this much longer than the subtitles
+
+# Reporting thresholds
+LONG_GAP_MS = 10000
+CPS_MIN = 2.0  # characters per second
+CPS_MAX = 30.0
+
+
+def check_talk(time_slices, audio_duration, labels=None):
+    """
+    Computes all quality statistics of a talk.
+    :param time_slices: List of (idx, (start_ms, end_ms)) as returned by txt_to_trans.
+    :param audio_duration: Duration of the talk audio in seconds.
+    :param labels: Optional list of cleaned labels, one per time slice, for the characters per second check.
+    :return: Returns a JSON-serializable dict of statistics, with 'reasons' listing failed checks and 'rejected'.
+    """
+    times = np.array([time_slice for _, time_slice in time_slices], dtype=np.int64).reshape(-1, 2)
+    starts, ends = times[:, 0], times[:, 1]
+    durations = ends - starts
+    gaps = starts[1:] - ends[:-1]
+    ms_counts = np.bincount(starts % 1000, minlength=1000)
+
+    report = {
+        "cues": int(len(times)),
+        "audio_duration": float(audio_duration),
+        "subtitle_duration": float(ends.max() / 1000) if len(times) else 0.0,
+        "repeated_ms_count": int(ms_counts[REPEATED_MS_VALUE]),
+        "most_common_ms": int(ms_counts.argmax()),
+        "most_common_ms_count": int(ms_counts.max()),
+        "non_positive_durations": int((durations <= 0).sum()),
+        "overlaps": int((gaps < 0).sum()),
+        "long_gaps": int((gaps > LONG_GAP_MS).sum()),
+        "max_gap_ms": int(gaps.max()) if len(gaps) else 0,
+        "unsorted_starts": int((np.diff(starts) < 0).sum()),
+    }
+    report["duration_diff"] = report["audio_duration"] - report["subtitle_duration"]
+
+    if labels is not None and len(times):
+        characters = np.array([len(label) for label in labels], dtype=np.float64)
+        cps = characters / np.maximum(durations, 1) * 1000
+        valid = durations > 0
+        report["cps_median"] = float(np.median(cps[valid])) if valid.any() else 0.0
+        report["cps_outliers"] = int(((cps < CPS_MIN) | (cps > CPS_MAX))[valid].sum())
+
+    reasons = []
+    if report["repeated_ms_count"] > REPEATED_OCCURRENCE:
+        reasons.append("repeated_ms")
+    if report["duration_diff"] > DURATION_DIFF:
+        reasons.append("intro_not_matched")
+    if report["cues"] == 0:
+        reasons.append("no_cues")
+    report["reasons"] = reasons
+    report["rejected"] = bool(reasons)
+    return report
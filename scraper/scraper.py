@@ -5,17 +5,20 @@ References:
 """
 
 from bs4 import BeautifulSoup
-from moviepy import editor
 import requests
-from urllib import request, error
 
 from ast import literal_eval
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 import logging
 import os
 import re
 import shutil
 
+from extract import ExtractionError, extract_audio, extract_audio_from_chunks
+from fetch import DOWNLOAD_CHUNK_SIZE, TRANSIENT_EXCEPTIONS, HttpClient
+from http_cache import NEGATIVE_STATUS_CODES, ResponseCache
+
 # Logger setup
 logger = logging.getLogger()
 logging.basicConfig(level="INFO", format="%(levelname)s: %(filename)s: %(message)s")
@@ -32,8 +35,17 @@ TED_SRT_HOMEPAGE = "https://ted2srt.org/"
 TED_SRT_TALKS = "talks/"
 TED_SRT_TALKPAGE = TED_SRT_HOMEPAGE + TED_SRT_TALKS
 
+# Concurrency
+SCRAPE_WORKERS = 8
+
+# Responses of talk pages and SRT transcripts, kept across runs
+HTTP_CACHE_ROOT = os.path.join(os.getcwd(), "http_cache")
+
+# Shared by every scraping function that is not given its own client
+default_client = HttpClient(cache=ResponseCache(HTTP_CACHE_ROOT))
 
-def main(number_of_talks=200, starting_video_id=100):
+
+def main(number_of_talks=200, starting_video_id=100, workers=SCRAPE_WORKERS, client=None):
     if not os.path.isdir(DATA_STORAGE_ROOT):
         try:
             os.makedirs(DATA_STORAGE_ROOT)
@@ -44,8 +56,7 @@ def main(number_of_talks=200, starting_video_id=100):
     # Uncomment to parse transcripts and audio from the TEDTalks website
     # logging.info("Parsing audio files with transcripts from TEDTalks website...")
     # video_urls = get_all_video_urls(TED_POPULAR_PAGE_URL)
-    # for url in video_urls:
-    #     scrape_data_from_url(url)
+    # scrape_talks(video_urls, scrape_data_from_url, workers=workers, client=client)
 
     # Uncomment to parse SRT transcripts and audio from the TED2SRT website
 
@@ -55,8 +66,31 @@ def main(number_of_talks=200, starting_video_id=100):
     logging.info("Parsing audio files with SRT transcripts from TED2SRT website...")
     # video_urls = get_all_srt_video_urls(TED_SRT_HOMEPAGE)
     video_urls = generate_all_srt_video_urls(TED_SRT_TALKPAGE, _number_of_talks, starting_video_id=_starting_video_id)
-    for url in video_urls:
-        scrape_data_from_srt_url(url)
+    scrape_talks(video_urls, scrape_data_from_srt_url, workers=workers, client=client)
+
+
+def scrape_talks(urls, scrape_function, workers=SCRAPE_WORKERS, client=None):
+    """
+    Scrapes many talk urls concurrently on a thread pool. All threads share one HttpClient, which caps the
+    concurrent requests and the request rate per host. A talk that raises is logged and does not stop the others.
+    :param urls: The talk urls to scrape.
+    :param scrape_function: scrape_data_from_srt_url or scrape_data_from_url.
+    :param workers: The number of threads.
+    :param client: The HttpClient to use, which defaults to default_client.
+    :return: Returns the list of urls whose scraping raised an exception.
+    """
+    client = client or default_client
+    failed_urls = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(scrape_function, url, client): url for url in urls}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                logger.exception(f"Scraping <{futures[future]}> failed.")
+                failed_urls.append(futures[future])
+    logging.info(f"Scraped {len(futures) - len(failed_urls)} of {len(futures)} urls.")
+    return failed_urls
 
 
 ## Code that handles scraping from the TED2SRT website
@@ -83,13 +117,14 @@ def generate_all_srt_video_urls(base_url, number_of_urls, starting_video_id=1):
 SUB_URL_KEY = "slug"
 
 
-def get_all_srt_video_urls(base_url):
+def get_all_srt_video_urls(base_url, client=None):
     """
     Gets all video urls, given the base url page. This is designed to work specifically for the TED2SRT page.
     :param base_url: The base url page (e.g. front page, 'all videos' page) to start searching from.
+    :param client: The HttpClient to use, which defaults to default_client.
     :return: Returns a list of all video urls found.
     """
-    response = requests.get(base_url)
+    response = (client or default_client).get(base_url)
     page_soup = BeautifulSoup(response.text, "html.parser")
 
     all_talks_object = page_soup.select("script")[0].string
@@ -116,25 +151,36 @@ START_OF_SRT_TRANSCRIPT_URL = "https://ted2srt.org/api/talks/"
 END_OF_SRT_TRANSCRIPT_URL = "/transcripts/download/srt?lang=en"
 
 
-def scrape_data_from_srt_url(url):
+def scrape_data_from_srt_url(url, client=None):
     """
     Attempts to scrape the audio file and SRT transcript from the given webpage.
     Specifically written to scrape data from the TED2SRT page (root: https://ted2srt.org/).
 
     If either the audio file or the SRT transcript does not exist, then this method will not scrape anything.
     Otherwise, the data will be saved to a folder marked by the url.
+    The talk page and the SRT transcript go through the client's response cache, and pages without metadata are
+    negatively cached, so a repeated sweep only downloads new talks and talks whose transcript changed. Only a 404/410
+    or a page without metadata is negatively cached; other error statuses raise requests.HTTPError.
     :param url: The url to scrape data from.
-    :return: No return value.
+    :param client: The HttpClient to use, which defaults to default_client.
+    :return: Returns the folder the talk was saved to, or None if nothing was scraped.
     """
+    client = client or default_client
     logger.info(f"\n\nScraping from url: <{url}>")
-    response = requests.get(url)
+    response = client.get_cached(url)
+    if response.status_code in NEGATIVE_STATUS_CODES:
+        logging.warning(f"The url {url} returned {response.status_code}. Continuing...")
+        return None
+    # other errors, e.g. a 503 that outlasted the retries, are temporary: raise them instead of caching them as negative
+    response.raise_for_status()
     page_soup = BeautifulSoup(response.text, "html.parser")
 
     # Identify the metadata object and parse the key phrases needed for video and SRT download
     talk_metadata_script = page_soup.select("script")
     if not talk_metadata_script:
         logging.warning(f"The url {url} is invalid or has no metadata object. Continuing...")
-        return
+        client.mark_negative(url)
+        return None
 
     talk_metadata_string = talk_metadata_script[0].string
     talk_metadata_object = literal_eval(talk_metadata_string.split(" = ")[1])
@@ -147,12 +193,25 @@ def scrape_data_from_srt_url(url):
     video_download_url = START_OF_AUDIO_DOWNLOAD_URL + video_download_keyword + END_OF_AUDIO_DOWNLOAD_URL
 
     saved_folder_path = os.path.join(DATA_STORAGE_ROOT, name_of_video)
+    srt_transcript_file_saved_location = os.path.join(saved_folder_path, SRT_TRANSCRIPT_FILE_EXTENSION)
+    previous_srt_transcript = None
+    if os.path.isfile(srt_transcript_file_saved_location):
+        with open(srt_transcript_file_saved_location, "rb") as file:
+            previous_srt_transcript = file.read()
 
-    success_status = download_and_save_srt_transcript_text(srt_download_url, saved_folder_path)
+    success_status = download_and_save_srt_transcript_text(srt_download_url, saved_folder_path, client)
     if not success_status:
-        return
+        return None
+
+    if os.path.isfile(os.path.join(saved_folder_path, AUDIO_FILE_EXTENSION)):
+        with open(srt_transcript_file_saved_location, "rb") as file:
+            if file.read() == previous_srt_transcript:
+                logger.info("Talk already scraped and its transcript is unchanged. Skipping the video...")
+                return saved_folder_path
 
-    download_and_save_video_file(video_download_url, saved_folder_path)
+    if not download_and_save_video_file(video_download_url, saved_folder_path, client):
+        return None
+    return saved_folder_path
 
 
 # Video constants
@@ -160,24 +219,46 @@ VIDEO_FILE_EXTENSION = "video.mp4"
 AUDIO_FILE_EXTENSION = "audio.mp3"
 SRT_TRANSCRIPT_FILE_EXTENSION = "srt_transcript.txt"
 
+# Audio extraction
+PIPE_VIDEO_DOWNLOAD = True  # extract the audio while the video downloads, without storing the video
+AUDIO_SAMPLE_RATE = None  # e.g. 16000 to save audio at the training sample rate; None keeps the source rate
+AUDIO_CHANNELS = None  # e.g. 1 to downmix; None keeps the source channels
+
 
-def download_and_save_video_file(video_download_url, path_to_save_to):
+def download_and_save_video_file(video_download_url, path_to_save_to, client=None):
     """
-    Downloads a video file, given its url link. Converts the video file to audio. Saves the file to the required folder.
-    Specifically designed for the TED2SRT website. Note that no audio download exists. Therefore, the video must be
-    downloaded first, and then converted into audio. To save space, the video file is then deleted.
+    Downloads a video file, given its url link, and saves its audio track to the required folder.
+    Specifically designed for the TED2SRT website. Note that no audio download exists, so the audio track is
+    extracted from the video with ffmpeg, without decoding the video stream.
+
+    With PIPE_VIDEO_DOWNLOAD, the download is piped straight into ffmpeg and the video is never stored. Videos that
+    cannot be read as a stream, or streams that break off, fall back to downloading the video file, extracting the
+    audio and deleting the video.
     :param video_download_url: The url to download the video from.
     :param path_to_save_to: The folder name to save this file to.
+    :param client: The HttpClient to use, which defaults to default_client.
     :return: Returns True if the download was successful, and False otherwise.
     """
+    client = client or default_client
     if not os.path.isdir(path_to_save_to):
         os.mkdir(path_to_save_to)
 
+    audio_file_saved_location = os.path.join(path_to_save_to, AUDIO_FILE_EXTENSION)
     video_file_saved_location = os.path.join(path_to_save_to, VIDEO_FILE_EXTENSION)
     try:
-        _, _ = request.urlretrieve(video_download_url, filename=video_file_saved_location)
+        if PIPE_VIDEO_DOWNLOAD:
+            try:
+                with client.open_stream(video_download_url) as response:
+                    extract_audio_from_chunks(response.iter_content(DOWNLOAD_CHUNK_SIZE), audio_file_saved_location,
+                                              AUDIO_SAMPLE_RATE, AUDIO_CHANNELS)
+                logging.info("Audio file saved from the video stream.")
+                return True
+            except (ExtractionError,) + TRANSIENT_EXCEPTIONS as exception:
+                logger.info(f"Streaming extraction failed ({exception}), downloading the video file instead...")
+
+        client.download(video_download_url, video_file_saved_location)
         logger.info("Video file saved.")
-    except error.HTTPError:
+    except requests.HTTPError:
         logger.warning("No video file of lowest quality found. Deleting this specific data folder...")
         srt_transcript_file_saved_location = os.path.join(path_to_save_to, SRT_TRANSCRIPT_FILE_EXTENSION)
 
@@ -189,25 +270,26 @@ def download_and_save_video_file(video_download_url, path_to_save_to):
 
         return False
 
-    logger.info("Converting video.mp4 file to audio.mp3 file...")
-    audio_file_saved_location = os.path.join(path_to_save_to, AUDIO_FILE_EXTENSION)
-
-    video = editor.VideoFileClip(video_file_saved_location)
-    audio = video.audio
-    audio.write_audiofile(audio_file_saved_location, verbose=False, logger=None)
-    video.close()
+    logger.info("Extracting the audio track of video.mp4 to audio.mp3...")
+    try:
+        extract_audio(video_file_saved_location, audio_file_saved_location, AUDIO_SAMPLE_RATE, AUDIO_CHANNELS)
+    except ExtractionError as exception:
+        logger.warning(f"Could not extract the audio track ({exception}). Deleting this specific data folder...")
+        shutil.rmtree(path_to_save_to, ignore_errors=True)
+        return False
 
     os.remove(video_file_saved_location)
     logging.info("Audio file saved. Video file deleted.")
     return True
 
 
-def download_and_save_srt_transcript_text(srt_transcript_url, path_to_save_to):
+def download_and_save_srt_transcript_text(srt_transcript_url, path_to_save_to, client=None):
     """
     Saves the transcript text to the required folder as a file. This is specifically designed to work with the TED2SRT
     website.
     :param srt_transcript_url: The url to download the srt transcript from.
     :param path_to_save_to: The folder name to save this file to.
+    :param client: The HttpClient to use, which defaults to default_client.
     :return: Returns True if the download was successful, and False otherwise.
     """
     if not os.path.isdir(path_to_save_to):
@@ -215,10 +297,14 @@ def download_and_save_srt_transcript_text(srt_transcript_url, path_to_save_to):
 
     srt_transcript_file_saved_location = os.path.join(path_to_save_to, SRT_TRANSCRIPT_FILE_EXTENSION)
     try:
-        _, _ = request.urlretrieve(srt_transcript_url, filename=srt_transcript_file_saved_location)
+        response = (client or default_client).get_cached(srt_transcript_url)
+        response.raise_for_status()
+        with open(srt_transcript_file_saved_location + ".tmp", "wb") as file:
+            file.write(response.content)
+        os.replace(srt_transcript_file_saved_location + ".tmp", srt_transcript_file_saved_location)
         logger.info("SRT transcript saved.")
         return True
-    except error.HTTPError:
+    except requests.HTTPError:
         logger.warning("No SRT transcript found. Deleting this specific data folder...")
         audio_file_saved_location = os.path.join(path_to_save_to, VIDEO_FILE_EXTENSION)
 
@@ -234,12 +320,14 @@ def download_and_save_srt_transcript_text(srt_transcript_url, path_to_save_to):
 ## Code that handles scraping from the TEDTalks website
 
 
-def get_all_video_urls(base_url):
+def get_all_video_urls(base_url, client=None):
     """
     Gets all video urls, given the base url page. It is assumed that the base url page is in page format (see comments).
     :param base_url: The base url page (e.g. front page, 'all videos' page) to start searching from.
+    :param client: The HttpClient to use, which defaults to default_client.
     :return: Returns a list of all video urls found.
     """
+    client = client or default_client
     urls = []
     page_number = 0
 
@@ -247,7 +335,7 @@ def get_all_video_urls(base_url):
         # i.e. search from "page=1", "page=2", "page=3"...
         page_number += 1
 
-        response = requests.get(base_url + str(page_number))
+        response = client.get(base_url + str(page_number))
 
         page_soup = BeautifulSoup(response.text, "html.parser")
         video_elements = page_soup.select("div.container.results div.col")
@@ -265,7 +353,7 @@ def get_all_video_urls(base_url):
     return urls
 
 
-def scrape_data_from_url(url):
+def scrape_data_from_url(url, client=None):
     """
     Attempts to scrape the audio file and transcript text from the given webpage.
     Specifically written to scrape data from the TEDTalks page (root: https://www.ted.com/talks).
@@ -273,9 +361,11 @@ def scrape_data_from_url(url):
     If either the audio file or the transcript does not exist, then this method will not scrape anything.
     Otherwise, the data will be saved to a folder marked by the url.
     :param url: The url to scrape data from.
+    :param client: The HttpClient to use, which defaults to default_client.
     :return: No return value.
     """
     assert url.startswith(TED_URL_PREFIX), f"Url provided does not start with expected url: <{url}>"
+    client = client or default_client
     logger.info(f"\n\nScraping from url: <{url}>")
 
     saved_folder_name = url.replace(TED_URL_PREFIX, "")
@@ -283,7 +373,7 @@ def scrape_data_from_url(url):
 
     # Check if transcript exists, by attempting to access the page tab
     url = url + "/transcript"
-    response = requests.get(url)
+    response = client.get(url)
     if not response.ok:
         logger.warning(f"No transcript exists: <{url}>")
         return
@@ -300,7 +390,7 @@ def scrape_data_from_url(url):
 
     # Save to file
     save_transcript_text(transcript_text, saved_folder_path)
-    download_and_save_audio_file(audio_download_link, saved_folder_path)
+    download_and_save_audio_file(audio_download_link, saved_folder_path, client)
 
 
 # Audio constants
@@ -355,18 +445,19 @@ def get_page_audio_download_link(page_text):
     return audio_metadata_url
 
 
-def download_and_save_audio_file(audio_download_url, path_to_save_to):
+def download_and_save_audio_file(audio_download_url, path_to_save_to, client=None):
     """
     Downloads an audio file, given its url link. Saves the file to the required folder.
     :param audio_download_url: The url to download the audio from.
     :param path_to_save_to: The folder name to save this file to.
+    :param client: The HttpClient to use, which defaults to default_client.
     :return: No return value.
     """
     if not os.path.isdir(path_to_save_to):
         os.mkdir(path_to_save_to)
 
     audio_file_saved_location = os.path.join(path_to_save_to, AUDIO_FILE_NAME)
-    _, _ = request.urlretrieve(audio_download_url, filename=audio_file_saved_location)
+    (client or default_client).download(audio_download_url, audio_file_saved_location)
     logger.info("Audio file saved.")
 
 
@@ -0,0 +1,91 @@
+"""
+Streaming SRT parser.
+
+An SRT file is a sequence of cue blocks separated by blank lines:
+
+    12
+    00:01:02,345 --> 00:01:04,000
+    first line of the caption
+    optional further lines
+
+Cues are parsed one line at a time, so a file is never read into memory as a whole.
+"""
+
+import re
+
+CUE_TIMING_PATTERN = re.compile(r"(\d+):(\d{2}):(\d{2})[,.](\d{3})\s*-->\s*(\d+):(\d{2}):(\d{2})[,.](\d{3})")
+
+
+def _timing_to_ms(match):
+    """
+    Converts a matched timing line to integer (start, end) milliseconds.
+    :param match: A match of CUE_TIMING_PATTERN.
+    :return: Returns a tuple of start and end milliseconds.
+    """
+    h1, m1, s1, ms1, h2, m2, s2, ms2 = map(int, match.groups())
+    start = ((h1 * 60 + m1) * 60 + s1) * 1000 + ms1
+    end = ((h2 * 60 + m2) * 60 + s2) * 1000 + ms2
+    return start, end
+
+
+def parse_srt_lines(lines):
+    """
+    Parses SRT cues from an iterable of lines.
+
+    A cue starts with an index line directly followed by a timing line, and its text runs until the next blank line
+    (or the next index + timing pair, for files missing the blank separator). Lines outside of a well-formed cue are
+    skipped instead of raising.
+    :param lines: An iterable of lines, e.g. an open file.
+    :return: Yields (index, start_ms, end_ms, text) tuples, with the caption lines joined by single spaces.
+    """
+    search_timing = CUE_TIMING_PATTERN.search
+    index = None  # index line seen outside of a cue, waiting for its timing line
+    cue = None  # [index, start, end, text lines] of the cue being read
+    held_index = None  # digits-only line inside a cue, which may be the start of the next cue
+
+    for line in lines:
+        line = line.strip()
+        if line.startswith("\ufeff"):
+            line = line[1:]
+
+        if cue is not None:
+            if held_index is not None:
+                timing = "-->" in line and search_timing(line)
+                if timing:
+                    yield cue[0], cue[1], cue[2], " ".join(cue[3])
+                    cue = [held_index, *_timing_to_ms(timing), []]
+                    held_index = None
+                    continue
+                cue[3].append(held_index)
+                held_index = None
+            if not line:
+                yield cue[0], cue[1], cue[2], " ".join(cue[3])
+                cue = None
+            elif line.isdigit():
+                held_index = line
+            else:
+                cue[3].append(line)
+            continue
+
+        if index is not None:
+            timing = "-->" in line and search_timing(line)
+            if timing:
+                cue = [index, *_timing_to_ms(timing), []]
+                index = None
+                continue
+        index = line if line.isdigit() else None
+
+    if cue is not None:
+        if held_index is not None:
+            cue[3].append(held_index)
+        yield cue[0], cue[1], cue[2], " ".join(cue[3])
+
+
+def iter_srt_cues(srt_path):
+    """
+    Streams the cues of an SRT file.
+    :param srt_path: The path to the SRT file.
+    :return: Yields (index, start_ms, end_ms, text) tuples.
+    """
+    with open(srt_path, "r", encoding="utf-8-sig", errors="replace") as file:
+        yield from parse_srt_lines(file)
@@ -0,0 +1,32 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_ROOT)
+sys.path.append(os.path.join(REPO_ROOT, "scraper"))
+sys.path.append(os.path.join(REPO_ROOT, "benchmarks"))
+
+
+@pytest.fixture(scope="session")
+def standin():
+    """ The stand-in ted2srt.org / download.ted.com server of tests/standin.py, shared by the session """
+    if not shutil.which("ffmpeg"):
+        pytest.skip("the stand-in server needs ffmpeg to make its media")
+    from standin import StandinServer
+
+    with StandinServer() as server:
+        yield server
+
+
+@pytest.fixture
+def scraper_data(tmp_path, monkeypatch):
+    """ Points the scraper's data folder at a temporary directory """
+    import scraper
+
+    data_root = tmp_path / "data"
+    data_root.mkdir()
+    monkeypatch.setattr(scraper, "DATA_STORAGE_ROOT", str(data_root))
+    return data_root
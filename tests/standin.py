@@ -0,0 +1,216 @@
+"""
+Local stand-in for ted2srt.org and download.ted.com, so the scraper and the ingestion pipeline can run offline.
+Point a scraper HttpClient at it with url_overrides=server.url_overrides.
+
+    /talks/<id>                                 talk page; ids in TALK_IDS have a metadata object, others do not
+    /api/talks/<id>/transcripts/download/srt    SRT transcript, 404 for ids in MISSING_SRT_IDS
+    /talks/<slug>-320k.mp4                      a short talk video, faststart for ids divisible by 4, with Range support
+    /flaky/<anything>                           503 with Retry-After: 0 the first time, then 200
+    /unavailable/<anything>                     always 503 with Retry-After: 0
+    /truncated/<anything>                       the video, cut off after a third of its body the first time (no Range)
+
+Pages and SRTs carry an ETag and answer If-None-Match with 304. Every request is counted per path, and the
+highest number of requests in flight at once is kept, to check concurrency limits; set latency to make
+requests overlap.
+The media is generated with ffmpeg when the server starts.
+"""
+
+import collections
+import hashlib
+import os
+import re
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TALK_IDS = frozenset(range(100, 300, 2))
+MISSING_SRT_IDS = frozenset(talk_id for talk_id in TALK_IDS if talk_id % 10 == 0)
+MEDIA_SECONDS = 20
+CUES = 7
+
+
+def talk_page(talk_id):
+    if talk_id not in TALK_IDS:
+        return b"<html><body>Talk not found</body></html>"
+    metadata = {"id": talk_id, "mediaSlug": f"Slug{talk_id}", "slug": f"talk_{talk_id}"}
+    return f"<html><script>window.talk = {metadata!r}</script></html>".encode()
+
+
+def format_timestamp(ms):
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+
+def talk_srt(talk_id):
+    """ CUES captions of 1.5 s, every 2 s, inside the MEDIA_SECONDS of the video """
+    cues = []
+    for index in range(1, CUES + 1):
+        start = index * 2000
+        cues.append(f"{index}\n{format_timestamp(start)} --> {format_timestamp(start + 1500)}\n"
+                    f"line {index} of talk {talk_id} in 1999\n")
+    return "\n".join(cues).encode()
+
+
+def make_media(media_dir):
+    """
+    Encodes a MEDIA_SECONDS video with a tone as audio, as the talk downloads are: talk.mp4 with the moov box at
+    the end and talk_faststart.mp4 with it at the start.
+    :return: Returns the bytes of (talk.mp4, talk_faststart.mp4).
+    """
+    media_path = os.path.join(media_dir, "talk.mp4")
+    faststart_path = os.path.join(media_dir, "talk_faststart.mp4")
+    subprocess.run(["ffmpeg", "-loglevel", "error", "-y", "-f", "lavfi", "-i", f"testsrc=size=160x120:rate=10:duration={MEDIA_SECONDS}",
+                    "-f", "lavfi", "-i", f"sine=frequency=440:duration={MEDIA_SECONDS}:sample_rate=44100",
+                    "-c:v", "mpeg4", "-c:a", "aac", "-shortest", media_path], check=True)
+    subprocess.run(["ffmpeg", "-loglevel", "error", "-y", "-i", media_path, "-c", "copy", "-movflags", "+faststart",
+                    faststart_path], check=True)
+    with open(media_path, "rb") as file, open(faststart_path, "rb") as faststart_file:
+        return file.read(), faststart_file.read()
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        # a request counts as in flight until its answer is ready, which is before the client can see it
+        self.server.request_started(self.path)
+        try:
+            time.sleep(self.server.latency)
+        finally:
+            self.server.request_finished()
+        self.route()
+
+    def route(self):
+        path = self.path
+        first_request = self.server.requests[path] == 1
+
+        match = re.fullmatch(r"/talks/(\d+)", path)
+        if match:
+            return self.send(200, talk_page(int(match.group(1))), revalidate=True)
+
+        match = re.fullmatch(r"/api/talks/(\d+)/transcripts/download/srt\?lang=en", path)
+        if match:
+            talk_id = int(match.group(1))
+            if talk_id in MISSING_SRT_IDS:
+                return self.send(404, b"Not found")
+            return self.send(200, talk_srt(talk_id), "text/plain", revalidate=True)
+
+        if path.startswith("/flaky/") and first_request:
+            return self.send(503, b"Busy", headers={"Retry-After": "0"})
+        if path.startswith("/flaky/"):
+            return self.send(200, b"OK", "text/plain")
+
+        if path.startswith("/unavailable/"):
+            return self.send(503, b"Busy", headers={"Retry-After": "0"})
+
+        if path.startswith("/truncated/") and first_request and "Range" not in self.headers:
+            return self.send_truncated(self.server.media)
+
+        if path.startswith("/misaligned/"):
+            return self.send_media(self.server.media, misaligned=True)
+
+        match = re.fullmatch(r"/talks/Slug(\d+)-320k\.mp4", path)
+        if match or path.startswith("/truncated/"):
+            faststart = match is not None and int(match.group(1)) % 4 == 0
+            return self.send_media(self.server.faststart_media if faststart else self.server.media)
+
+        self.send(404, b"Not found")
+
+    def send(self, status_code, body, content_type="text/html", headers=None, revalidate=False):
+        headers = dict(headers or {})
+        if revalidate:
+            headers["ETag"] = '"' + hashlib.sha1(body).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == headers["ETag"]:
+                status_code, body = 304, b""
+        self.send_response(status_code)
+        self.send_header("Content-Length", str(len(body)))
+        if status_code != 304:
+            self.send_header("Content-Type", content_type)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_media(self, body, misaligned=False):
+        """ body, or the requested range of it; misaligned answers a range from half its requested start instead """
+        byte_range = self.headers.get("Range")
+        if not byte_range:
+            return self.send(200, body, "video/mp4", {"Accept-Ranges": "bytes"})
+        start = int(byte_range.split("=")[1].split("-")[0])
+        if misaligned:
+            start //= 2
+        self.send(206, body[start:], "video/mp4", {"Accept-Ranges": "bytes",
+                                                   "Content-Range": f"bytes {start}-{len(body) - 1}/{len(body)}"})
+
+    def send_truncated(self, body):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        self.wfile.write(body[:len(body) // 3])
+        self.wfile.flush()
+        self.close_connection = True
+        self.connection.shutdown(socket.SHUT_RDWR)
+
+
+class StandinServer(ThreadingHTTPServer):
+    """
+    The stand-in server, on a free local port, serving from a background thread while used as a context manager.
+    requests counts the requests per path; max_in_flight is the highest number of concurrent requests seen.
+    Every request waits latency seconds before it is answered.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandinHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.url_overrides = {"https://ted2srt.org": self.url, "https://download.ted.com": self.url}
+        self.latency = 0.0
+        self.requests = collections.Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        media_dir = tempfile.mkdtemp()
+        try:
+            self.media, self.faststart_media = make_media(media_dir)
+        finally:
+            shutil.rmtree(media_dir)
+
+    def request_started(self, path):
+        with self._lock:
+            self.requests[path] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def request_finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def count(self, pattern):
+        """ Number of requests to paths matching the regular expression pattern """
+        with self._lock:
+            return sum(count for path, count in self.requests.items() if re.search(pattern, path))
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests.clear()
+            self.max_in_flight = self.in_flight
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
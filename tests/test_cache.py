@@ -0,0 +1,18 @@
+import torch
+
+from utils.cache import FeatureCache
+
+
+def test_entries_depend_on_the_feature_source(tmp_path):
+    audio_path = tmp_path / "utt.wav"
+    audio_path.write_bytes(b"audio")
+    decoded = FeatureCache(str(tmp_path / "cache"), n_feats=13, source="decode")
+    from_store = FeatureCache(str(tmp_path / "cache"), n_feats=13, source="store")
+
+    decoded.store(str(audio_path), torch.ones(1, 13, 5))
+    assert torch.equal(decoded.load(str(audio_path)), torch.ones(1, 13, 5))
+    assert from_store.load(str(audio_path)) is None
+
+    from_store.store(str(audio_path), torch.zeros(1, 13, 5))
+    assert torch.equal(from_store.load(str(audio_path)), torch.zeros(1, 13, 5))
+    assert decoded.load(str(audio_path)) is None # one entry per file, the stale one is dropped
@@ -0,0 +1,106 @@
+import pytest
+import torch
+
+from dataset import compute_mfcc
+from utils.features import KaldiMFCC, StreamingMFCC
+
+N_FEATS = (13, 40, 80, 128)
+SAMPLE_RATE = 16000
+# KaldiMFCC and kaldi mfcc round differently in float32, by up to this fraction of the largest coefficient
+TOLERANCE = 4e-6
+
+
+def random_waveform(num_samples, generator):
+    return torch.randn(num_samples, generator=generator) * 0.1
+
+
+def random_chunks(waveform, generator, max_chunk=4000):
+    """ Splits waveform into chunks of random sizes, empty chunks and chunks shorter than a frame included """
+    chunks, start = [], 0
+    while start < len(waveform):
+        size = int(torch.randint(0, max_chunk, (1,), generator=generator))
+        chunks.append(waveform[start:start + size])
+        start += size
+    return chunks
+
+
+@pytest.mark.parametrize("n_feats", N_FEATS)
+def test_batched_matches_kaldi(n_feats):
+    generator = torch.Generator().manual_seed(n_feats)
+    mfcc = KaldiMFCC(n_feats)
+    # shorter than a window, exactly one window, one sample more, and longer items, zero-padded to one batch
+    lengths = [mfcc.window_size - 1, mfcc.window_size, mfcc.window_size + 1, 12345, SAMPLE_RATE, 2 * SAMPLE_RATE]
+    waveforms = torch.zeros(len(lengths), max(lengths))
+    for index, length in enumerate(lengths):
+        waveforms[index, :length] = random_waveform(length, generator)
+
+    features, frame_lengths = mfcc(waveforms, lengths)
+    assert features.shape == (len(lengths), n_feats, int(frame_lengths.max()))
+    assert frame_lengths.tolist() == [0, 1, 1] + [compute_mfcc(waveforms[i:i + 1, :lengths[i]], n_feats).shape[2] for i in range(3, len(lengths))]
+    for index, length in enumerate(lengths):
+        frames = int(frame_lengths[index])
+        if frames:
+            expected = compute_mfcc(waveforms[index:index + 1, :length], n_feats)
+            torch.testing.assert_close(features[index:index + 1, :, :frames], expected,
+                                       atol=TOLERANCE * float(expected.abs().max()), rtol=0)
+        assert not features[index, :, frames:].any()
+
+
+def test_batched_items_do_not_depend_on_the_batch():
+    generator = torch.Generator().manual_seed(0)
+    mfcc = KaldiMFCC(40)
+    waveform = random_waveform(SAMPLE_RATE, generator)
+    alone, _ = mfcc(waveform.unsqueeze(0), [len(waveform)])
+    padded = torch.stack((waveform, torch.zeros(len(waveform))))
+    padded = torch.cat((padded, torch.randn(2, 4000, generator=generator)), dim=1) # junk past the lengths
+    batched, _ = mfcc(padded, [len(waveform), 0])
+    assert torch.equal(batched[:1, :, :alone.shape[2]], alone)
+
+
+@pytest.mark.parametrize("n_feats", N_FEATS)
+@pytest.mark.parametrize("seed", range(3))
+def test_streaming_matches_batched(n_feats, seed):
+    generator = torch.Generator().manual_seed(seed)
+    waveform = random_waveform(int(torch.randint(SAMPLE_RATE, 3 * SAMPLE_RATE, (1,), generator=generator)), generator)
+    expected, frame_lengths = KaldiMFCC(n_feats)(waveform.unsqueeze(0), [len(waveform)])
+
+    streaming = StreamingMFCC(n_feats)
+    features = torch.cat([streaming.accept(chunk) for chunk in random_chunks(waveform, generator)], dim=2)
+    assert features.shape == expected.shape
+    assert torch.equal(features, expected)
+    assert streaming.num_frames == int(frame_lengths[0])
+    assert streaming.num_samples == len(waveform)
+
+
+@pytest.mark.parametrize("n_feats", N_FEATS)
+def test_streaming_matches_compute_mfcc(n_feats):
+    """ AudioDataset's default features are kaldi mfcc, which StreamingMFCC matches up to float32 rounding """
+    generator = torch.Generator().manual_seed(n_feats)
+    waveform = random_waveform(2 * SAMPLE_RATE + 123, generator)
+    expected = compute_mfcc(waveform.unsqueeze(0), n_feats)
+
+    streaming = StreamingMFCC(n_feats)
+    features = torch.cat([streaming.accept(chunk) for chunk in random_chunks(waveform, generator)], dim=2)
+    assert features.shape == expected.shape
+    torch.testing.assert_close(features, expected, atol=TOLERANCE * float(expected.abs().max()), rtol=0)
+
+
+def test_streaming_int16_chunks_and_reset():
+    generator = torch.Generator().manual_seed(0)
+    pcm = torch.round(random_waveform(SAMPLE_RATE, generator) * 32768).to(torch.int16)
+    expected, _ = KaldiMFCC(40)((pcm.float() / 32768).unsqueeze(0), [len(pcm)])
+
+    streaming = StreamingMFCC(40)
+    streaming.accept(torch.zeros(1234, dtype=torch.int16))
+    streaming.reset()
+    features = torch.cat([streaming.accept(chunk) for chunk in random_chunks(pcm, generator)], dim=2)
+    assert torch.equal(features, expected)
+
+
+def test_streaming_emits_frames_as_soon_as_complete():
+    mfcc = StreamingMFCC(13)
+    window_size, window_shift = mfcc.mfcc.window_size, mfcc.mfcc.window_shift
+    assert mfcc.accept(torch.zeros(window_size - 1)).shape == (1, 13, 0)
+    assert mfcc.accept(torch.zeros(1)).shape == (1, 13, 1)
+    assert mfcc.accept(torch.zeros(window_shift - 1)).shape == (1, 13, 0)
+    assert mfcc.accept(torch.zeros(1)).shape == (1, 13, 1)
@@ -0,0 +1,98 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+import scraper
+from fetch import HttpClient
+from http_cache import ResponseCache
+
+FIRST_TALK_ID = 100
+NUMBER_OF_TALKS = 12
+
+
+def sweep(client):
+    urls = scraper.generate_all_srt_video_urls(scraper.TED_SRT_TALKPAGE, NUMBER_OF_TALKS, starting_video_id=FIRST_TALK_ID)
+    assert scraper.scrape_talks(urls, scraper.scrape_data_from_srt_url, workers=4, client=client) == []
+
+
+def test_repeated_sweep_stays_off_the_network(standin, scraper_data, tmp_path):
+    client = HttpClient(url_overrides=standin.url_overrides, cache=ResponseCache(str(tmp_path / "cache")))
+    sweep(client)
+    talks = sorted(os.listdir(scraper_data))
+
+    standin.reset_counts()
+    sweep(client)
+    assert sum(standin.requests.values()) == 0
+    assert sorted(os.listdir(scraper_data)) == talks
+
+
+def test_stale_entries_are_revalidated(standin, scraper_data, tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache"), fresh_seconds=0)
+    client = HttpClient(url_overrides=standin.url_overrides, cache=cache)
+    sweep(client)
+
+    standin.reset_counts()
+    sweep(client)
+    # live pages and SRTs are revalidated (and answered with 304), dead ids and missing SRTs stay negative,
+    # and no video is downloaded again since no transcript changed
+    assert standin.count(r"-320k\.mp4$") == 0
+    assert standin.count(r"^/talks/\d+$") == NUMBER_OF_TALKS // 2
+    assert standin.count(r"/srt\?") == 4
+
+
+def test_negative_ttl_counts_from_the_first_miss(standin, tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache"))
+    client = HttpClient(cache=cache)
+    url = standin.url + "/talks/101"
+    assert scraper.scrape_data_from_srt_url(url, client) is None
+    checked_at = cache.lookup(url)["checked_at"]
+    assert cache.lookup(url)["negative"]
+
+    standin.reset_counts()
+    for _ in range(3):
+        assert scraper.scrape_data_from_srt_url(url, client) is None
+        cache.mark_negative(url)
+    assert standin.requests["/talks/101"] == 0
+    assert cache.lookup(url)["checked_at"] == checked_at
+
+
+def test_only_missing_pages_are_negatively_cached(standin, tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache"))
+    client = HttpClient(retries=1, backoff_seconds=0.01, cache=cache)
+    unavailable_url = standin.url + "/unavailable/talks/102"
+    with pytest.raises(requests.HTTPError):
+        scraper.scrape_data_from_srt_url(unavailable_url, client)
+    assert cache.lookup(unavailable_url) is None
+
+    missing_url = standin.url + "/missing/talks/102"
+    assert scraper.scrape_data_from_srt_url(missing_url, client) is None
+    assert cache.lookup(missing_url)["negative"]
+
+
+def test_expired_negative_entries_are_fetched_again(standin, tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache"), negative_ttl_seconds=-1)
+    client = HttpClient(cache=cache)
+    url = standin.url + "/talks/101"
+    standin.reset_counts()
+    scraper.scrape_data_from_srt_url(url, client)
+    scraper.scrape_data_from_srt_url(url, client)
+    assert standin.requests["/talks/101"] == 2
+
+
+def test_concurrent_writers_of_one_url(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache"))
+    url = "https://ted2srt.org/talks/102"
+
+    def store(index):
+        cache.store(url, 200, {"ETag": f'"{index}"'}, f"body {index}".encode())
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(store, range(200)))
+
+    assert sorted(os.listdir(cache.cache_dir)) == sorted(os.path.basename(cache._path(url, suffix)) for suffix in (".body", ".json"))
+    with open(cache._path(url, ".json")) as file:
+        assert json.load(file)["status_code"] == 200
+    assert cache.body(url).startswith(b"body ")
@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import soundfile
+import torch
+
+from utils.manifest import Manifest, pack_strings, swap_in_dir
+from utils.waveform_store import WaveformStore
+
+
+def make_manifest(audio_dir, labels):
+    audio_blob, audio_offsets = pack_strings([f"utt-{index}.wav" for index in range(len(labels))])
+    label_blob, label_offsets = pack_strings(labels)
+    num_frames = np.arange(1, len(labels) + 1, dtype=np.int64) * 100
+    return Manifest(str(audio_dir), audio_blob, audio_offsets, label_blob, label_offsets, num_frames,
+                    np.full(len(labels), 16000, dtype=np.int32))
+
+
+def test_swap_in_dir(tmp_path):
+    target_dir = tmp_path / "target"
+    for version in ("first", "second"):
+        tmp_dir = tmp_path / f"{version}.tmp"
+        tmp_dir.mkdir()
+        (tmp_dir / f"{version}.txt").write_text(version)
+        swap_in_dir(str(tmp_dir), str(target_dir))
+        assert os.listdir(target_dir) == [f"{version}.txt"]
+    assert sorted(os.listdir(tmp_path)) == ["target"]
+
+
+def test_manifest_round_trip(tmp_path):
+    manifest = make_manifest(tmp_path, ["hello", "", "naïve café"])
+    manifest.save(str(tmp_path / ".manifest"))
+    manifest.save(str(tmp_path / ".manifest"))
+    loaded = Manifest.load(str(tmp_path / ".manifest"))
+    assert len(loaded) == 3
+    assert [loaded.label(index) for index in range(3)] == ["hello", "", "naïve café"]
+    assert loaded.audio_path(2) == os.path.join(str(tmp_path), "utt-2.wav")
+    assert loaded.durations.tolist() == manifest.durations.tolist()
+
+
+def test_manifest_is_rebuilt_when_the_sources_change(tmp_path):
+    def write_utterance(name, label):
+        soundfile.write(str(tmp_path / f"{name}.wav"), np.zeros(160, dtype=np.int16), 16000)
+        (tmp_path / f"{name}.txt").write_text(label)
+
+    write_utterance("a", "first")
+    assert [Manifest.open(str(tmp_path), str(tmp_path)).label(0) for _ in range(2)] == ["first", "first"]
+
+    write_utterance("b", "second")
+    assert len(Manifest.open(str(tmp_path), str(tmp_path))) == 2
+
+    os.remove(tmp_path / "b.wav")
+    assert len(Manifest.open(str(tmp_path), str(tmp_path))) == 1
+
+    (tmp_path / "a.txt").write_text("edited")
+    os.utime(tmp_path / "a.txt", ns=(0, os.stat(tmp_path / "a.wav").st_mtime_ns + 10**9))
+    assert Manifest.open(str(tmp_path), str(tmp_path)).label(0) == "edited"
+
+
+def test_waveform_store_rebuild(tmp_path):
+    manifest = make_manifest(tmp_path, ["one", "two", "three"])
+    store_dir = str(tmp_path / "store")
+
+    def load_waveform(audio_path):
+        index = int(os.path.basename(audio_path)[len("utt-"):-len(".wav")])
+        return torch.full((1, manifest.num_frames[index]), index / 4)
+
+    store = WaveformStore.open(store_dir, manifest, load_waveform, 16000)
+    assert WaveformStore.open(store_dir, manifest, load_waveform, 16000).meta == store.meta
+    rebuilt = WaveformStore.open(store_dir, manifest, load_waveform, 8000)
+    assert rebuilt.sample_rate == 8000
+    assert sorted(os.listdir(tmp_path)) == ["store"]
+    for index in range(len(manifest)):
+        assert rebuilt.label(index) == manifest.label(index)
+        waveform = rebuilt.waveform(index)
+        assert waveform.dtype == torch.int16 and len(waveform) == manifest.num_frames[index]
+        assert int(waveform[0]) == index * 8192
@@ -0,0 +1,46 @@
+import json
+import shutil
+
+import pytest
+
+import pipeline
+import preprocess
+import scraper
+from fetch import HttpClient
+from standin import CUES, MISSING_SRT_IDS, TALK_IDS
+
+requires_ffprobe = pytest.mark.skipif(not shutil.which("ffprobe"), reason="pydub decodes the talks with ffprobe and ffmpeg")
+
+FIRST_TALK_ID = 100
+NUMBER_OF_TALKS = 12
+STAGES = ["download", "parse", "decode", "check", "slice", "write"]
+
+
+@pytest.fixture
+def output_root(tmp_path, monkeypatch):
+    output_root = tmp_path / "out"
+    monkeypatch.setattr(preprocess, "path", str(output_root))
+    monkeypatch.setattr(preprocess, "txt_src_path", str(output_root / "txt_src.txt"))
+    return output_root
+
+
+@requires_ffprobe
+def test_ingest(standin, scraper_data, output_root):
+    client = HttpClient(url_overrides=standin.url_overrides)
+    urls = scraper.generate_all_srt_video_urls(scraper.TED_SRT_TALKPAGE, NUMBER_OF_TALKS, starting_video_id=FIRST_TALK_ID)
+    talks = len(set(range(FIRST_TALK_ID, FIRST_TALK_ID + NUMBER_OF_TALKS)) & (TALK_IDS - MISSING_SRT_IDS))
+
+    stats = pipeline.ingest(urls, output_format="shards", client=client, queue_size=1)
+    assert list(stats) == STAGES
+    assert stats["download"]["items"] == NUMBER_OF_TALKS
+    assert all(stats[stage]["items"] == talks for stage in STAGES[1:])
+    assert all(stage_stats["errors"] == 0 for stage_stats in stats.values())
+    assert all(stage_stats["max_queue_depth"] <= 1 for name, stage_stats in stats.items() if name != "download")
+    with open(output_root / "train" / "index.json") as file:
+        shards = json.load(file)["shards"]
+    assert sum(shard["count"] for shard in shards) == talks * CUES
+
+    # nothing changed: every talk is skipped once the ledger has seen it
+    stats = pipeline.ingest(urls, output_format="shards", client=client)
+    assert stats["parse"]["items"] == talks
+    assert all(stats[stage]["items"] == 0 for stage in STAGES[2:])
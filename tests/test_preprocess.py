@@ -0,0 +1,77 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import preprocess
+from fixtures import make_talks
+
+@pytest.fixture
+def output_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(preprocess, "path", str(tmp_path / "out"))
+    monkeypatch.setattr(preprocess, "txt_src_path", str(tmp_path / "out" / "txt_src.txt"))
+    return tmp_path / "out" / preprocess.split
+
+
+@pytest.fixture(scope="module")
+def talks(tmp_path_factory):
+    if not (shutil.which("ffmpeg") and shutil.which("ffprobe")):
+        pytest.skip("the talk fixtures and pydub need ffmpeg and ffprobe")
+    src_path = tmp_path_factory.mktemp("talks")
+    make_talks(str(src_path), 6, cues=4)
+    return src_path
+
+
+def ledger_ids(output_root):
+    with open(output_root / ".ledger.json") as file:
+        return {talk: entry["id"] for talk, entry in json.load(file)["talks"].items()}
+
+
+@pytest.mark.parametrize("output_format", ["files", "shards"])
+def test_interrupted_convert_does_not_duplicate_talks(talks, output_root, monkeypatch, output_format):
+    commit = preprocess.TalkOutput.commit
+    commits = []
+
+    def interrupted_commit(self, curr_folder, *args):
+        if len(commits) == 4:
+            raise KeyboardInterrupt
+        commits.append(curr_folder)
+        return commit(self, curr_folder, *args)
+
+    monkeypatch.setattr(preprocess.TalkOutput, "commit", interrupted_commit)
+    with pytest.raises(KeyboardInterrupt):
+        preprocess.convert(str(talks), output_format, workers=1)
+    monkeypatch.setattr(preprocess.TalkOutput, "commit", commit)
+    preprocess.convert(str(talks), output_format, workers=1)
+
+    ids = ledger_ids(output_root)
+    assert sorted(ids) == sorted(os.listdir(talks))
+    assert sorted(ids.values(), key=int) == [str(talk_id) for talk_id in range(6)]
+    if output_format == "files":
+        talk_folders = [name for name in os.listdir(output_root) if os.path.isdir(output_root / name) and name != ".lm"]
+        assert sorted(talk_folders) == sorted(ids.values())
+    else:
+        with open(output_root / "index.json") as file:
+            index = json.load(file)
+        readable = {talk_id for shard in index["shards"] for talk_id in shard["talks"]} - set(index["retired"])
+        assert readable == set(ids.values())
+    assert sorted(os.listdir(output_root / ".lm")) == sorted(f"{talk_id}.txt" for talk_id in ids.values())
+
+
+def test_talks_are_saved_as_they_finish(talks, output_root, monkeypatch):
+    commit = preprocess.TalkOutput.commit
+    commits = []
+
+    def interrupted_commit(self, curr_folder, *args):
+        if len(commits) == 2:
+            raise KeyboardInterrupt
+        commits.append(curr_folder)
+        return commit(self, curr_folder, *args)
+
+    monkeypatch.setattr(preprocess.TalkOutput, "commit", interrupted_commit)
+    with pytest.raises(KeyboardInterrupt):
+        preprocess.convert(str(talks), "files", workers=2)
+    with open(output_root / ".ledger.json") as file:
+        done = {talk for talk, entry in json.load(file)["talks"].items() if entry["status"] == "done"}
+    assert done == set(commits) == set(sorted(os.listdir(talks))[:2])
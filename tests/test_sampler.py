@@ -0,0 +1,27 @@
+import numpy as np
+
+from utils.sampler import BucketBatchSampler
+
+
+def test_drop_last_drops_only_the_last_short_batch():
+    lengths = np.random.default_rng(0).integers(100, 1000, size=1003)
+    sampler = BucketBatchSampler(lengths, batch_size=8, pool_batches=5, drop_last=True)
+    batches = sampler.batches()
+    assert all(len(batch) == 8 for batch in batches)
+    assert len(batches) == len(lengths) // 8
+
+    kept = BucketBatchSampler(lengths, batch_size=8, pool_batches=5).batches()
+    assert sorted(index for batch in kept for index in batch) == list(range(len(lengths)))
+    assert sorted(len(batch) for batch in kept)[1:] == [8] * (len(kept) - 1)
+
+
+def test_drop_last_keeps_batches_closed_by_max_frames():
+    lengths = np.array([100] * 40 + [1000] * 40)
+    sampler = BucketBatchSampler(lengths, batch_size=16, max_frames=4000, pool_batches=2, drop_last=True, shuffle=False)
+    batches = sampler.batches()
+    assert sum(len(batch) for batch in batches) == len(lengths)
+    assert {len(batch) for batch in batches} == {16, 8, 4}
+
+    lengths = np.array([100] * 40 + [1000] * 41)
+    sampler = BucketBatchSampler(lengths, batch_size=16, max_frames=4000, pool_batches=2, drop_last=True, shuffle=False)
+    assert sum(len(batch) for batch in sampler.batches()) == len(lengths) - 1
@@ -0,0 +1,109 @@
+import os
+import time
+
+import pytest
+
+import scraper
+import fetch
+from fetch import TRANSIENT_EXCEPTIONS, HttpClient, IncompleteDownloadError
+from standin import MISSING_SRT_IDS, TALK_IDS
+
+FIRST_TALK_ID = 100
+NUMBER_OF_TALKS = 12
+TALK_RANGE = range(FIRST_TALK_ID, FIRST_TALK_ID + NUMBER_OF_TALKS)
+SCRAPED_TALKS = sorted(f"talk_{talk_id}" for talk_id in TALK_RANGE if talk_id in TALK_IDS and talk_id not in MISSING_SRT_IDS)
+
+
+def talk_urls():
+    return scraper.generate_all_srt_video_urls(scraper.TED_SRT_TALKPAGE, NUMBER_OF_TALKS, starting_video_id=FIRST_TALK_ID)
+
+
+def test_scrape_talks_concurrently(standin, scraper_data):
+    client = HttpClient(per_host_concurrency=3, backoff_seconds=0.01, url_overrides=standin.url_overrides)
+    standin.reset_counts()
+    standin.latency = 0.02
+    try:
+        failed_urls = scraper.scrape_talks(talk_urls(), scraper.scrape_data_from_srt_url, workers=8, client=client)
+    finally:
+        standin.latency = 0.0
+
+    assert failed_urls == []
+    assert sorted(os.listdir(scraper_data)) == SCRAPED_TALKS
+    for talk in SCRAPED_TALKS:
+        assert sorted(os.listdir(scraper_data / talk)) == [scraper.AUDIO_FILE_EXTENSION, scraper.SRT_TRANSCRIPT_FILE_EXTENSION]
+        assert os.path.getsize(scraper_data / talk / scraper.AUDIO_FILE_EXTENSION) > 0
+    assert 1 < standin.max_in_flight <= client.per_host_concurrency
+
+
+def test_rate_limit(standin):
+    client = HttpClient(per_host_concurrency=4, requests_per_second=20)
+    start_time = time.monotonic()
+    for _ in range(6):
+        client.get(standin.url + "/talks/101")
+    assert time.monotonic() - start_time >= 5 / 20
+
+
+def test_retries_transient_status(standin):
+    client = HttpClient(backoff_seconds=0.01)
+    response = client.get(standin.url + "/flaky/retry")
+    assert response.status_code == 200
+    assert standin.count("^/flaky/retry$") == 2
+
+
+def test_no_retries_left(standin):
+    client = HttpClient(retries=0)
+    assert client.get(standin.url + "/flaky/no-retry").status_code == 503
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """ Chunks smaller than the stand-in media, so a truncated body leaves some of it in the .part file """
+    monkeypatch.setattr(fetch, "DOWNLOAD_CHUNK_SIZE", 16 * 1024)
+
+
+def test_download_resumes_truncated_body(standin, tmp_path, small_chunks):
+    client = HttpClient(backoff_seconds=0.01)
+    file_path = str(tmp_path / "video.mp4")
+    client.download(standin.url + "/truncated/resume.mp4", file_path)
+    with open(file_path, "rb") as file:
+        assert file.read() == standin.media
+    assert not os.path.exists(file_path + ".part")
+
+
+def test_download_resumes_on_a_later_call(standin, tmp_path, small_chunks):
+    client = HttpClient(retries=0)
+    file_path = str(tmp_path / "video.mp4")
+    with pytest.raises(TRANSIENT_EXCEPTIONS + (IncompleteDownloadError,)):
+        client.download(standin.url + "/truncated/later.mp4", file_path)
+    assert not os.path.exists(file_path)
+    assert 0 < os.path.getsize(file_path + ".part") < len(standin.media)
+
+    client.download(standin.url + "/truncated/later.mp4", file_path)
+    with open(file_path, "rb") as file:
+        assert file.read() == standin.media
+
+
+def test_failed_extraction_removes_the_talk_folder(standin, tmp_path, monkeypatch):
+    def fail(*args):
+        raise scraper.ExtractionError("no audio stream")
+
+    monkeypatch.setattr(scraper, "extract_audio", fail)
+    talk_folder = tmp_path / "talk_101"
+    talk_folder.mkdir()
+    (talk_folder / scraper.SRT_TRANSCRIPT_FILE_EXTENSION).write_text("1\n")
+    # Slug1 is not faststart, so streaming fails and the video file is downloaded first
+    client = HttpClient(url_overrides=standin.url_overrides)
+    assert not scraper.download_and_save_video_file(standin.url + "/talks/Slug1-320k.mp4", str(talk_folder), client)
+    assert not talk_folder.exists()
+
+
+@pytest.mark.parametrize("part_size", [1, 1000])
+def test_download_restarts_on_a_misaligned_range(standin, tmp_path, part_size):
+    """ A 206 from byte 0 is written over the .part file, one from any other wrong byte discards it and retries """
+    client = HttpClient(backoff_seconds=0.01)
+    file_path = str(tmp_path / "video.mp4")
+    with open(file_path + ".part", "wb") as file:
+        file.write(b"x" * part_size)
+    client.download(standin.url + "/misaligned/video.mp4", file_path)
+    with open(file_path, "rb") as file:
+        assert file.read() == standin.media
@@ -0,0 +1,28 @@
+import glob
+import json
+import os
+
+import pytest
+
+from subtitles import iter_srt_cues, parse_srt_lines
+
+SRT_FIXTURES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "srt", "*.srt")))
+
+
+@pytest.mark.parametrize("srt_path", SRT_FIXTURES, ids=os.path.basename)
+def test_iter_srt_cues(srt_path):
+    """ Every fixture <name>.srt is parsed to the cues listed in <name>.json """
+    with open(srt_path[:-len(".srt")] + ".json", encoding="utf-8") as file:
+        expected = [tuple(cue) for cue in json.load(file)]
+    assert list(iter_srt_cues(srt_path)) == expected
+
+
+def test_parse_srt_lines_is_lazy():
+    def lines():
+        yield "1\n"
+        yield "00:00:01,000 --> 00:00:02,000\n"
+        yield "first\n"
+        yield "\n"
+        raise AssertionError("read past the first cue")
+
+    assert next(parse_srt_lines(lines())) == ("1", 1000, 2000, "first")
@@ -0,0 +1,10 @@
+from utils import normalize
+from utils.text import TextProcess
+
+CAPTIONS = ["In 1999, 42 people came!", "It's 7 o'clock -- re-entry", "  Ünïcode   and    spaces  ", "100 ideas in 2012"]
+
+
+def test_dataset_labels_use_the_preprocess_normalization():
+    text_process = TextProcess()
+    assert [text_process.clean_text(caption) for caption in CAPTIONS] == normalize.normalize_corpus(CAPTIONS)
+    assert text_process.clean_text("In 1999, 42 people came!") == "in nineteen ninety nine forty two people came"
@@ -0,0 +1,93 @@
+import random
+import zlib
+
+import numpy as np
+import torch
+
+from utils.features import resampler, resampled_num_samples
+
+
+def _random_spans(lengths, count, max_widths, size, generator):
+    """
+    (batch, size) bool mask of count random spans per row, each at most max_widths[row] wide and inside the
+    first lengths[row] positions of the row
+    """
+    batch = len(lengths)
+    widths = (torch.rand(batch, count, generator=generator) * (max_widths.unsqueeze(1) + 1)).long()
+    starts = (torch.rand(batch, count, generator=generator) * (lengths.unsqueeze(1) - widths + 1)).long()
+    positions = torch.arange(size)
+    inside = (positions >= starts.unsqueeze(-1)) & (positions < (starts + widths).unsqueeze(-1)) # (batch, count, size)
+    return inside.any(dim=1)
+
+
+class BatchAugment:
+    """
+    Augmentation of a whole padded batch in the collate stage, as a few tensor ops per batch instead of
+    Python work per utterance.
+        waveforms: speed perturbation (one factor of speed_factors per batch, by resampling the batch at once)
+                   and volume perturbation (a gain per item, uniform in gain_db)
+        spectrograms: SpecAugment frequency and time masks, drawn per item inside its true length; time masks
+                      are at most time_mask_width frames and max_time_fraction of the item
+    Every batch is augmented with its own generator, seeded from seed, the epoch and the batch's labels, so
+    results are reproducible whatever the number of DataLoader workers. Call set_epoch before every epoch.
+    Pass to ContiguousCollate (spectrograms only, as features are already computed) or BatchFeatureCollate.
+    """
+
+    def __init__(self, freq_masks=2, freq_mask_width=15, time_masks=2, time_mask_width=40, max_time_fraction=0.1,
+                 speed_factors=None, gain_db=None, sample_rate=16000, seed=0):
+        self.freq_masks = freq_masks
+        self.freq_mask_width = freq_mask_width
+        self.time_masks = time_masks
+        self.time_mask_width = time_mask_width
+        self.max_time_fraction = max_time_fraction
+        self.speed_factors = speed_factors # e.g. (0.9, 1.0, 1.1)
+        self.gain_db = gain_db # e.g. (-6, 6)
+        self.sample_rate = sample_rate
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def generator(self, labels, lengths):
+        """ Generator for one batch, seeded from the padded labels and the item lengths """
+        batch_hash = zlib.crc32(labels.numpy().tobytes(), zlib.crc32(np.asarray(lengths, dtype=np.int64).tobytes()))
+        generator = torch.Generator()
+        generator.manual_seed(random.Random(f'{self.seed}-{self.epoch}-{batch_hash}').getrandbits(63))
+        return generator
+
+    def waveforms(self, waveforms, lengths, generator):
+        """
+        waveforms: zero-padded (batch, samples) float tensor; lengths: sample count of each item
+        Return the perturbed waveforms and their new lengths (a long tensor)
+        """
+        lengths = torch.as_tensor(lengths, dtype=torch.long)
+        if self.speed_factors:
+            factor = self.speed_factors[int(torch.randint(len(self.speed_factors), (1,), generator=generator))]
+            if factor != 1:
+                # played at sample_rate, audio recorded at sample_rate * factor runs factor times faster
+                source_rate = int(round(self.sample_rate * factor))
+                waveforms = resampler(source_rate, self.sample_rate)(waveforms)
+                lengths = torch.from_numpy(resampled_num_samples(lengths.numpy(), source_rate, self.sample_rate))
+        if self.gain_db:
+            low, high = self.gain_db
+            gains_db = low + (high - low) * torch.rand(len(waveforms), generator=generator)
+            waveforms = waveforms * torch.pow(10.0, gains_db / 20).unsqueeze(1)
+        return waveforms, lengths
+
+    def spectrograms(self, spectrograms, frame_lengths, generator):
+        """
+        spectrograms: zero-padded (batch, 1, n_feats, frames); frame_lengths: true frame count of each item
+        Masks are filled with 0, like the padding, in place.
+        """
+        batch, _, n_feats, frames = spectrograms.shape
+        frame_lengths = torch.as_tensor(frame_lengths, dtype=torch.long)
+        if self.freq_masks:
+            widths = torch.full((batch,), min(self.freq_mask_width, n_feats), dtype=torch.long)
+            freq_mask = _random_spans(torch.full((batch,), n_feats, dtype=torch.long), self.freq_masks, widths, n_feats, generator)
+            spectrograms.masked_fill_(freq_mask[:, None, :, None], 0.)
+        if self.time_masks:
+            widths = torch.clamp((frame_lengths * self.max_time_fraction).long(), max=self.time_mask_width)
+            time_mask = _random_spans(frame_lengths, self.time_masks, widths, frames, generator)
+            spectrograms.masked_fill_(time_mask[:, None, None, :], 0.)
+        return spectrograms
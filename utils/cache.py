@@ -0,0 +1,59 @@
+import hashlib
+import json
+import os
+import glob
+
+import numpy as np
+import torch
+
+
+class FeatureCache:
+    """
+    Persistent on-disk cache of per-utterance features.
+    Each entry is a .npy file named '<path hash>.<state hash>.npy', where the state hash covers the
+    file mtime/size and the feature parameters. A changed input or changed parameters therefore
+    never match a stale entry, and the stale entry is removed when the new one is stored.
+    Entries are opened memory-mapped so reading them costs only the pages actually touched.
+    """
+
+    def __init__(self, cache_dir, **params):
+        self.cache_dir = cache_dir
+        self.params = params
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path_hash(self, audio_path):
+        return hashlib.sha1(os.path.abspath(audio_path).encode('utf-8')).hexdigest()
+
+    def _state_hash(self, audio_path):
+        stat = os.stat(audio_path)
+        state = [stat.st_mtime_ns, stat.st_size, sorted(self.params.items())]
+        return hashlib.sha1(json.dumps(state).encode('utf-8')).hexdigest()[:16]
+
+    def entry_path(self, audio_path):
+        path_hash = self._path_hash(audio_path)
+        return os.path.join(self.cache_dir, path_hash[:2], f'{path_hash}.{self._state_hash(audio_path)}.npy')
+
+    def load(self, audio_path):
+        """ Return the cached features for audio_path, or None if there is no valid entry """
+        try:
+            # copy-on-write mapping so torch gets a writable tensor without reading the whole file
+            return torch.from_numpy(np.load(self.entry_path(audio_path), mmap_mode='c'))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def store(self, audio_path, features):
+        """ Atomically write features for audio_path and drop entries made for older states of the file """
+        entry_path = self.entry_path(audio_path)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        tmp_path = f'{entry_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, features.numpy())
+        os.replace(tmp_path, entry_path)
+
+        path_prefix = os.path.basename(entry_path).split('.')[0]
+        for stale_path in glob.glob(os.path.join(os.path.dirname(entry_path), path_prefix + '.*.npy')):
+            if stale_path != entry_path:
+                try:
+                    os.remove(stale_path)
+                except FileNotFoundError:
+                    pass # removed by another worker
@@ -0,0 +1,136 @@
+import functools
+import math
+
+import numpy as np
+import torch
+import torchaudio
+from torchaudio.compliance.kaldi import get_mel_banks
+
+
+@functools.lru_cache(maxsize=None)
+def resampler(orig_freq, new_freq):
+    """
+    Resample transform for one (source rate, target rate) pair. Its filter kernel is built on the first call and
+    reused after that; the cache is per process, so every DataLoader worker builds each kernel once.
+    """
+    return torchaudio.transforms.Resample(int(orig_freq), int(new_freq))
+
+
+def _matmul_rows(rows, weights):
+    """
+    rows (..., k) @ weights (k, n). A single row is computed as part of a two-row product: BLAS takes a
+    matrix-vector path for one row that rounds differently, and a frame's features should not depend on how
+    many frames are computed together (streaming emits frames one at a time).
+    """
+    flat = rows.reshape(-1, rows.shape[-1])
+    if len(flat) == 1:
+        return torch.cat((flat, flat)).matmul(weights)[:1].reshape(*rows.shape[:-1], -1)
+    return rows.matmul(weights)
+
+
+def resampled_num_samples(num_samples, orig_freq, new_freq):
+    """ Sample count after resampling num_samples (int or numpy array) from orig_freq to new_freq, as Resample returns it """
+    return -(-np.asarray(num_samples, dtype=np.int64) * new_freq // orig_freq)
+
+
+class KaldiMFCC:
+    """
+    Batched, vectorized equivalent of torchaudio.compliance.kaldi.mfcc with its default options
+    (povey window, 0.97 preemphasis, dc offset removal, snip_edges, no energy, lifter 22).
+    Every kaldi step works on single frames, so framing a zero-padded batch and masking the frames past
+    each item's length gives the same features as running kaldi mfcc on every item on its own, up to float32
+    rounding: within 4e-6 of an item's largest coefficient (about 1e-4 absolute with 128 coefficients, 2e-5 with 13).
+    The window, mel banks, DCT matrix and lifter are built once instead of on every call.
+    """
+
+    def __init__(self, n_feats, frame_length=25, frame_shift=10, sample_rate=16000, preemphasis=0.97, cepstral_lifter=22.0):
+        self.n_feats = n_feats
+        self.sample_rate = sample_rate
+        self.window_size = int(sample_rate * frame_length * 0.001)
+        self.window_shift = int(sample_rate * frame_shift * 0.001)
+        self.padded_window_size = 2 ** (self.window_size - 1).bit_length()
+        self.preemphasis = preemphasis
+
+        self.window = torch.hann_window(self.window_size, periodic=False).pow(0.85)
+        mel_banks, _ = get_mel_banks(n_feats, self.padded_window_size, float(sample_rate), 20.0, 0.0, 100.0, -500.0, 1.0)
+        self.mel_banks = torch.nn.functional.pad(mel_banks, (0, 1), mode='constant', value=0).T.contiguous()
+        dct_matrix = torchaudio.functional.create_dct(n_feats, n_feats, 'ortho')
+        dct_matrix[:, 0] = math.sqrt(1 / float(n_feats))
+        lifter = 1.0 + 0.5 * cepstral_lifter * torch.sin(math.pi * torch.arange(n_feats) / cepstral_lifter)
+        self.dct_lifter = (dct_matrix * lifter).contiguous() # lifter scales output columns, so fold it into the DCT
+        self.epsilon = torch.tensor(torch.finfo(torch.float).eps)
+
+    def num_frames(self, num_samples):
+        """ Number of complete frames in num_samples samples (int or integer tensor) """
+        if isinstance(num_samples, torch.Tensor):
+            return torch.clamp(num_samples - self.window_size, min=-1) // self.window_shift + 1
+        return max(num_samples - self.window_size, -1) // self.window_shift + 1
+
+    def frames_to_features(self, frames):
+        """ frames (..., window_size) -> MFCCs (..., n_feats) """
+        frames = frames - frames.mean(dim=-1, keepdim=True)
+        previous = torch.cat((frames[..., :1], frames[..., :-1]), dim=-1)
+        frames = (frames - self.preemphasis * previous) * self.window
+        spectrum = torch.fft.rfft(frames, n=self.padded_window_size).abs().pow(2.0)
+        mel_energies = torch.max(_matmul_rows(spectrum, self.mel_banks), self.epsilon).log()
+        return _matmul_rows(mel_energies, self.dct_lifter)
+
+    def __call__(self, waveforms, lengths):
+        """
+        waveforms: zero-padded (batch, samples) float tensor; lengths: true sample count of each item
+        Return features (batch, n_feats, frames) with frames past each item's length zeroed, and frame counts
+        """
+        lengths = torch.as_tensor(lengths, dtype=torch.long)
+        frame_lengths = self.num_frames(lengths)
+        max_frames = int(frame_lengths.max()) if len(frame_lengths) else 0
+        batch_size = waveforms.shape[0]
+        if max_frames <= 0:
+            return waveforms.new_zeros(batch_size, self.n_feats, 0), frame_lengths
+
+        needed = (max_frames - 1) * self.window_shift + self.window_size
+        frames = waveforms[:, :needed].unfold(1, self.window_size, self.window_shift) # (batch, frames, window)
+        features = self.frames_to_features(frames)
+        mask = torch.arange(max_frames).unsqueeze(0) < frame_lengths.unsqueeze(1)
+        features = features * mask.unsqueeze(-1)
+        return features.transpose(1, 2), frame_lengths
+
+
+class StreamingMFCC:
+    """
+    Incremental front-end for live audio. The output is bit-identical to KaldiMFCC on the whole signal (and so to
+    BatchFeatureCollate), while dataset.compute_mfcc, the kaldi mfcc path AudioDataset uses by default, differs by
+    float32 rounding only, within the KaldiMFCC tolerance (4e-6 of the largest coefficient).
+    accept() takes mono PCM chunks of any size (float, or int16 scaled like torchaudio.load), carries the samples
+    of the frames not complete yet over to the next call, and returns only the newly completed frames as
+    (1, n_feats, new frames), the layout of dataset.compute_mfcc. Frames never depend on each other, so the
+    concatenated output is the same as KaldiMFCC on the concatenated audio.
+    Work per call is proportional to the chunk, and a frame is emitted as soon as its last sample arrives.
+    Chunks must already be at sample_rate.
+    """
+
+    def __init__(self, n_feats, frame_length=25, frame_shift=10, sample_rate=16000):
+        self.mfcc = KaldiMFCC(n_feats, frame_length=frame_length, frame_shift=frame_shift, sample_rate=sample_rate)
+        self.reset()
+
+    def reset(self):
+        """ Start a new stream """
+        self._pending = torch.zeros(0)
+        self.num_samples = 0
+        self.num_frames = 0
+
+    def accept(self, chunk):
+        chunk = torch.as_tensor(chunk).reshape(-1)
+        if chunk.dtype == torch.int16:
+            chunk = chunk.float() / 32768.0
+        self.num_samples += len(chunk)
+        samples = torch.cat((self._pending, chunk.float()))
+        num_frames = self.mfcc.num_frames(len(samples))
+        if num_frames <= 0:
+            self._pending = samples
+            return samples.new_zeros(1, self.mfcc.n_feats, 0)
+        needed = (num_frames - 1) * self.mfcc.window_shift + self.mfcc.window_size
+        frames = samples[:needed].unfold(0, self.mfcc.window_size, self.mfcc.window_shift) # (frames, window)
+        features = self.mfcc.frames_to_features(frames)
+        self._pending = samples[num_frames * self.mfcc.window_shift:].clone() # the start of the next frame on
+        self.num_frames += num_frames
+        return features.T.unsqueeze(0)
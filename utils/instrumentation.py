@@ -0,0 +1,114 @@
+import contextlib
+import os
+import time
+
+import numpy as np
+import torch
+
+# 'open' is reading a waveform store item; reading audio files is timed as part of 'decode'
+LOADER_STAGES = ('open', 'decode', 'downmix', 'resample', 'features', 'text_clean', 'text_encode', 'padding', 'augment')
+MAX_WORKERS = 64
+# histogram bucket i counts durations in [2**(i-1), 2**i) microseconds; the first bucket is < 1 us, the last open-ended
+HISTOGRAM_BUCKETS = 26
+
+_COUNT, _TOTAL, _FIRST_BUCKET = 0, 1, 2
+
+_NULL_TIMER = contextlib.nullcontext()
+
+
+def _current_row():
+    """ Row 0 for the main process, 1 + worker id inside a DataLoader worker """
+    worker_info = torch.utils.data.get_worker_info()
+    return 0 if worker_info is None else worker_info.id + 1
+
+
+class LoaderStats:
+    """
+    Opt-in per-stage counters and timing histograms for the data loader.
+    The numbers live in one shared-memory tensor with a row per process (row 0 for the main process, then one
+    per DataLoader worker), so every worker writes its own row without locking, and the main process sees all of
+    them; summary() aggregates across workers.
+    Rows are shared with workers started by fork as well as spawn. Each process should record from one thread.
+
+        stats = LoaderStats()
+        with stats.time('decode'):
+            ...
+        stats.summary()['decode']['mean_ms']
+    """
+
+    def __init__(self, stages=LOADER_STAGES, max_workers=MAX_WORKERS):
+        self.stages = tuple(stages)
+        self._index = {stage: i for i, stage in enumerate(self.stages)}
+        self.table = torch.zeros(max_workers + 1, len(self.stages), _FIRST_BUCKET + HISTOGRAM_BUCKETS,
+                                 dtype=torch.float64).share_memory_()
+        self._row = None
+        self._row_pid = None
+
+    def _row_view(self):
+        # rows are looked up once per process; forked workers start with the parent's cached pid and look again
+        pid = os.getpid()
+        if self._row_pid != pid:
+            self._row = self.table[_current_row()].numpy()
+            self._row_pid = pid
+        return self._row
+
+    def __getstate__(self):
+        return dict(self.__dict__, _row=None, _row_pid=None) # the numpy row view would be pickled as a copy
+
+    def record(self, stage, seconds):
+        row = self._row_view()[self._index[stage]]
+        row[_COUNT] += 1
+        row[_TOTAL] += seconds
+        microseconds = seconds * 1e6
+        bucket = int(microseconds).bit_length() if microseconds >= 1 else 0
+        row[_FIRST_BUCKET + min(bucket, HISTOGRAM_BUCKETS - 1)] += 1
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def reset(self):
+        self.table.zero_()
+
+    def summary(self):
+        """
+        Per stage: count, total_s, mean_ms, approximate p50_ms / p90_ms / p99_ms (upper edges of the histogram
+        buckets), the histogram itself ('histogram_us': {upper edge in us: count}) and 'per_worker' counts
+        (key 'main' for the main process). Stages that never ran are left out.
+        """
+        table = self.table.numpy()
+        totals = table.sum(axis=0)
+        edges = [2.0 ** i for i in range(HISTOGRAM_BUCKETS - 1)] + [float('inf')]
+        summary = {}
+        for stage, i in self._index.items():
+            count = totals[i, _COUNT]
+            if count == 0:
+                continue
+            histogram = totals[i, _FIRST_BUCKET:]
+            cumulative = np.cumsum(histogram) / count
+
+            def percentile_ms(q):
+                return edges[min(int(np.searchsorted(cumulative, q)), HISTOGRAM_BUCKETS - 1)] / 1000
+
+            per_worker = {('main' if row == 0 else int(row) - 1): int(table[row, i, _COUNT])
+                          for row in np.nonzero(table[:, i, _COUNT])[0]}
+            summary[stage] = {
+                'count': int(count),
+                'total_s': float(totals[i, _TOTAL]),
+                'mean_ms': float(totals[i, _TOTAL] / count * 1000),
+                'p50_ms': percentile_ms(0.5),
+                'p90_ms': percentile_ms(0.9),
+                'p99_ms': percentile_ms(0.99),
+                'histogram_us': {edge: int(n) for edge, n in zip(edges, histogram) if n},
+                'per_worker': per_worker,
+            }
+        return summary
+
+
+def stage_timer(stats, stage):
+    """ stats.time(stage), or a no-op context when instrumentation is off (stats is None) """
+    return _NULL_TIMER if stats is None else stats.time(stage)
@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+
+import numpy as np
+import torchaudio
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.mp3')
+LABEL_EXTENSION = '.txt'
+TRANSCRIPT_EXTENSION = '.trans.txt'
+MANIFEST_DIR_NAME = '.manifest'
+
+
+def _walk_files(root, extensions):
+    """ Recursively list files under root with one of the extensions, as paths relative to root """
+    found = []
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(root, rel_dir)) as entries:
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name)
+                if entry.is_dir():
+                    if not entry.name.startswith('.'):
+                        stack.append(rel_path)
+                elif entry.name.endswith(extensions):
+                    found.append(rel_path)
+    return found
+
+
+def _read_labels(label_dir):
+    """
+    Map utterance id to raw label text.
+    Supports one '<id>.txt' file per utterance, and '.trans.txt' files holding 'id label' lines as written by preprocess.
+    """
+    labels = {}
+    for rel_path in _walk_files(label_dir, (LABEL_EXTENSION,)):
+        with open(os.path.join(label_dir, rel_path)) as f_input:
+            if rel_path.endswith(TRANSCRIPT_EXTENSION):
+                for line in f_input:
+                    utt_id, _, text = line.rstrip('\n').partition(' ')
+                    labels[utt_id] = text
+            else:
+                labels[os.path.splitext(os.path.basename(rel_path))[0]] = f_input.read()
+    return labels
+
+
+def _audio_info(path):
+    """
+    (num_frames, sample_rate) of an audio file, read from its header.
+    soundfile first: torchaudio.info is gone from recent torchaudio releases, so it is only a fallback.
+    """
+    if soundfile is not None:
+        info = soundfile.info(path)
+        return info.frames, info.samplerate
+    if hasattr(torchaudio, 'info'):
+        info = torchaudio.info(path)
+        return info.num_frames, info.sample_rate
+    raise ImportError('reading audio headers needs soundfile, or a torchaudio release that still has torchaudio.info')
+
+
+def source_fingerprint(audio_dir, label_dir):
+    """
+    File count and latest modification time (ns) of the audio files and of the label files a manifest is built from.
+    Adding, removing or rewriting any of them changes it; the manifest directory itself is hidden and not counted.
+    """
+    fingerprint = {}
+    for name, root, extensions in (('audio', audio_dir, AUDIO_EXTENSIONS), ('labels', label_dir, (LABEL_EXTENSION,))):
+        rel_paths = _walk_files(root, extensions)
+        latest = max((os.stat(os.path.join(root, rel_path)).st_mtime_ns for rel_path in rel_paths), default=0)
+        fingerprint[name] = [len(rel_paths), latest]
+    return fingerprint
+
+
+def pack_strings(strings):
+    """ Pack strings into one utf-8 byte array plus an offsets array of length len(strings) + 1 """
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def load_array(path):
+    """ Load a .npy file memory-mapped (read-only) """
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError: # empty arrays cannot be memory-mapped
+        return np.load(path)
+
+
+def swap_in_dir(tmp_dir, target_dir):
+    """
+    Replace target_dir by tmp_dir, a complete directory on the same file system, so readers never see a half
+    written one. Replacing an existing directory takes two renames, and target_dir is missing in between: a
+    reader opening it at that moment finds nothing and builds its own copy. Readers that already opened the old
+    files keep reading them, as they are unlinked, not overwritten.
+    """
+    if not os.path.isdir(target_dir):
+        os.rename(tmp_dir, target_dir)
+        return
+    old_dir = f'{target_dir}.{os.getpid()}.old'
+    os.rename(target_dir, old_dir)
+    os.rename(tmp_dir, target_dir)
+    for name in os.listdir(old_dir):
+        os.remove(os.path.join(old_dir, name))
+    os.rmdir(old_dir)
+
+
+class Manifest:
+    """
+    Sorted, explicit audio path <-> label <-> duration table with O(1) indexed access.
+    Saved as a directory of .npy arrays (utf-8 blobs with offsets, frame counts, sample rates) that are opened
+    memory-mapped, so opening a manifest of millions of utterances only maps a handful of files.
+    fingerprint is the source_fingerprint of the directories it was built from, None if unknown.
+    """
+
+    ARRAYS = ('audio_blob', 'audio_offsets', 'label_blob', 'label_offsets', 'num_frames', 'sample_rates')
+
+    def __init__(self, audio_dir, audio_blob, audio_offsets, label_blob, label_offsets, num_frames, sample_rates,
+                 fingerprint=None):
+        self.audio_dir = audio_dir
+        self.fingerprint = fingerprint
+        self.audio_blob = audio_blob
+        self.audio_offsets = audio_offsets
+        self.label_blob = label_blob
+        self.label_offsets = label_offsets
+        self.num_frames = num_frames
+        self.sample_rates = sample_rates
+
+    @classmethod
+    def build(cls, audio_dir, label_dir):
+        """ Scan audio_dir and label_dir once, pairing each audio file with the label of the same utterance id """
+        fingerprint = source_fingerprint(audio_dir, label_dir) # before the scan, so files changed during it count as changes
+        labels = _read_labels(label_dir)
+        audio_paths, audio_labels, num_frames, sample_rates = [], [], [], []
+        missing = 0
+        for rel_path in sorted(_walk_files(audio_dir, AUDIO_EXTENSIONS)):
+            utt_id = os.path.splitext(os.path.basename(rel_path))[0]
+            if utt_id not in labels:
+                missing += 1
+                continue
+            frames, sample_rate = _audio_info(os.path.join(audio_dir, rel_path))
+            audio_paths.append(rel_path)
+            audio_labels.append(labels[utt_id])
+            num_frames.append(frames)
+            sample_rates.append(sample_rate)
+        if missing:
+            logger.warning(f"{missing} audio files in {audio_dir} have no label and were left out of the manifest")
+
+        audio_blob, audio_offsets = pack_strings(audio_paths)
+        label_blob, label_offsets = pack_strings(audio_labels)
+        return cls(audio_dir, audio_blob, audio_offsets, label_blob, label_offsets,
+                   np.asarray(num_frames, dtype=np.int64), np.asarray(sample_rates, dtype=np.int32), fingerprint)
+
+    @classmethod
+    def load(cls, manifest_dir, audio_dir=None):
+        with open(os.path.join(manifest_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: load_array(os.path.join(manifest_dir, name + '.npy')) for name in cls.ARRAYS}
+        return cls(audio_dir or meta['audio_dir'], fingerprint=meta.get('fingerprint'), **arrays)
+
+    def save(self, manifest_dir):
+        """ Write the manifest to a temporary directory and swap it in; see swap_in_dir for what concurrent readers see """
+        tmp_dir = f'{manifest_dir}.{os.getpid()}.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(tmp_dir, name + '.npy'), getattr(self, name))
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({'audio_dir': os.path.abspath(self.audio_dir), 'count': len(self), 'fingerprint': self.fingerprint}, f)
+        swap_in_dir(tmp_dir, manifest_dir)
+
+    @classmethod
+    def open(cls, audio_dir, label_dir, manifest_dir=None, rebuild=False):
+        """
+        Load the persisted manifest, building and saving it first if it does not exist yet, or if audio or label
+        files were added, removed or modified since it was built (see source_fingerprint).
+        """
+        manifest_dir = manifest_dir or os.path.join(audio_dir, MANIFEST_DIR_NAME)
+        if not rebuild and os.path.isfile(os.path.join(manifest_dir, 'meta.json')):
+            manifest = cls.load(manifest_dir, audio_dir)
+            if manifest.fingerprint == source_fingerprint(audio_dir, label_dir):
+                return manifest
+            logger.info(f"{audio_dir} or {label_dir} changed since the manifest was built, rebuilding it")
+        manifest = cls.build(audio_dir, label_dir)
+        manifest.save(manifest_dir)
+        return manifest
+
+    def __len__(self):
+        return len(self.audio_offsets) - 1
+
+    def _string(self, blob, offsets, index):
+        return bytes(blob[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+    def audio_path(self, index):
+        return os.path.join(self.audio_dir, self._string(self.audio_blob, self.audio_offsets, index))
+
+    def label(self, index):
+        return self._string(self.label_blob, self.label_offsets, index)
+
+    def duration(self, index):
+        """ Duration in seconds """
+        return self.num_frames[index] / self.sample_rates[index]
+
+    @property
+    def durations(self):
+        return self.num_frames / self.sample_rates
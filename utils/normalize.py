@@ -0,0 +1,48 @@
+"""
+Text normalization shared by training (TextProcess.clean_text) and preprocessing (scraper/preprocess.py),
+so both produce byte-identical labels.
+"""
+
+import re
+from functools import lru_cache
+from multiprocessing import Pool
+
+import num2words
+
+NORMALIZATION_VERSION = 1 # bump when labels change, so preprocess.convert redoes processed talks
+NUMBER_CACHE_SIZE = 65536
+CORPUS_CHUNK_SIZE = 1024
+
+# a token is a run of word characters; everything else (whitespace and punctuation) separates tokens
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+@lru_cache(maxsize=NUMBER_CACHE_SIZE)
+def verbalize_number(token):
+    """
+    Spell out a digits-only token, four digit tokens as years: '1999' -> 'nineteen ninety nine'.
+    Hyphens and commas of the num2words output are dropped, leaving only letters and spaces.
+    TED transcripts repeat the same numbers and years a lot, so results are memoized.
+    """
+    words = num2words.num2words(token, to='year') if len(token) == 4 else num2words.num2words(token)
+    return ' '.join(words.replace('-', ' ').replace(',', ' ').split())
+
+
+def clean_text(text):
+    """
+    Normalize text to a label: lowercase, punctuation removed, numbers and years spelled out,
+    words separated by single spaces. The text is tokenized once.
+    """
+    return ' '.join([verbalize_number(token) if token.isdigit() else token
+                     for token in TOKEN_PATTERN.findall(text.lower())])
+
+
+def normalize_corpus(texts, workers=1, chunksize=CORPUS_CHUNK_SIZE):
+    """
+    clean_text over a whole corpus, in order. With workers > 1 the texts are spread over a process pool in
+    chunks of chunksize; each process keeps its own number cache.
+    """
+    if workers <= 1:
+        return [clean_text(text) for text in texts]
+    with Pool(workers) as pool:
+        return pool.map(clean_text, texts, chunksize=chunksize)
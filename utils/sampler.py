@@ -0,0 +1,98 @@
+import numpy as np
+import torch
+
+
+def padding_efficiency(lengths, batches):
+    """
+    Fraction of the padded batch area filled with real frames, over all batches.
+    1.0 means no padding at all; random batching of TED slices is typically far below that.
+    """
+    lengths = np.asarray(lengths)
+    used, padded = 0, 0
+    for batch in batches:
+        batch_lengths = lengths[batch]
+        used += int(batch_lengths.sum())
+        padded += int(batch_lengths.max()) * len(batch)
+    return used / padded if padded else 1.0
+
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    """
+    Batch sampler that groups utterances of similar length to cut padding in collate_fn.
+    Every epoch the indices are shuffled and split into pools of batch_size * pool_batches items; each pool
+    is sorted by length and cut into batches, and the order of all batches is shuffled again. The items of the
+    last batch of a pool, which is usually short, join the next pool, so only the last batch of the epoch can be
+    short, and drop_last drops just that one.
+    With max_frames, a batch is closed once its padded size (longest item * items) would exceed max_frames,
+    so batches of short utterances hold more items than batches of long ones.
+    Pass as DataLoader(dataset, batch_sampler=BucketBatchSampler(dataset.lengths, ...), collate_fn=collate_fn)
+    """
+
+    def __init__(self, lengths, batch_size=32, max_frames=None, pool_batches=100, shuffle=True, drop_last=False, seed=0):
+        if batch_size is None and max_frames is None:
+            raise ValueError("Either batch_size or max_frames must be set")
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.max_frames = max_frames
+        self.pool_size = (batch_size or 32) * pool_batches
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self._batches = None
+
+    def set_epoch(self, epoch):
+        """ Reseed the shuffling; call before each epoch for a different but reproducible order """
+        self.epoch = epoch
+        self._batches = None
+
+    def _split_pool(self, pool):
+        """ Sort pool by length and cut it into batches; returns (closed batches, items of the open last batch) """
+        pool = pool[np.argsort(self.lengths[pool], kind='stable')]
+        batches = []
+        batch, batch_max = [], 0
+        for index in pool:
+            length = self.lengths[index]
+            full = self.batch_size is not None and len(batch) >= self.batch_size
+            too_long = self.max_frames is not None and len(batch) > 0 and max(batch_max, length) * (len(batch) + 1) > self.max_frames
+            if full or too_long:
+                batches.append(batch)
+                batch, batch_max = [], 0
+            batch.append(int(index))
+            batch_max = max(batch_max, length)
+        return batches, batch
+
+    def _short(self, batch):
+        """ Whether batch still had room for another item of its longest length, under batch_size and max_frames """
+        if self.batch_size is None or len(batch) >= self.batch_size:
+            return False
+        return self.max_frames is None or int(self.lengths[batch].max()) * (len(batch) + 1) <= self.max_frames
+
+    def batches(self):
+        """ The list of batches for the current epoch """
+        if self._batches is None:
+            rng = np.random.default_rng(self.seed + self.epoch)
+            indices = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+            batches, batch = [], []
+            for start in range(0, len(indices), self.pool_size):
+                pool = np.concatenate((np.asarray(batch, dtype=indices.dtype), indices[start:start + self.pool_size]))
+                pool_batches, batch = self._split_pool(pool)
+                batches.extend(pool_batches)
+            if batch and not (self.drop_last and self._short(batch)):
+                batches.append(batch)
+            if self.shuffle:
+                batches = [batches[i] for i in rng.permutation(len(batches))]
+            self._batches = batches
+        return self._batches
+
+    def padding_efficiency(self):
+        return padding_efficiency(self.lengths, self.batches())
+
+    def __iter__(self):
+        batches = self.batches()
+        self._batches = None
+        self.epoch += 1 # next epoch reshuffles unless set_epoch is called
+        return iter(batches)
+
+    def __len__(self):
+        return len(self.batches())
@@ -0,0 +1,148 @@
+import io
+import json
+import os
+import tarfile
+
+INDEX_FILE_NAME = 'index.json'
+SHARD_MAX_BYTES = 256 * 1024 * 1024
+
+
+def _add_member(tar, name, data):
+    member = tarfile.TarInfo(name)
+    member.size = len(data)
+    tar.addfile(member, io.BytesIO(data))
+
+
+class ShardWriter:
+    """
+    Pack utterances into large sequential tar shards, so training reads a few big files instead of many tiny ones.
+    Each utterance is stored as '<key>.<audio ext>', '<key>.txt' (cleaned label) and '<key>.json' (metadata),
+    which also keeps the shards readable with plain tar.
+    A shard is written under a temporary name and renamed once complete, and index.json lists the completed
+    shards with their utterance counts and the talks they hold.
+    Opening an existing shard_dir appends new shards. A talk written again supersedes its copy in older shards,
+    and retire() drops talks altogether; readers skip superseded and retired talks.
+    on_shard_closed is called with the talks of each shard once it is complete.
+    """
+
+    def __init__(self, shard_dir, prefix='shard', max_bytes=SHARD_MAX_BYTES, on_shard_closed=None):
+        self.shard_dir = shard_dir
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.on_shard_closed = on_shard_closed
+        os.makedirs(shard_dir, exist_ok=True)
+        index = _load_index(shard_dir)
+        self.shards = index['shards']
+        self.retired = set(index.get('retired', []))
+        self._tar = None
+        self._tmp_path = None
+        self._count = 0
+        self._talks = {}
+
+    def _open_shard(self):
+        self._name = f'{self.prefix}-{len(self.shards):05d}.tar'
+        self._tmp_path = os.path.join(self.shard_dir, self._name + '.tmp')
+        self._tar = tarfile.open(self._tmp_path, 'w')
+        self._count = 0
+        self._talks = {}
+
+    def _close_shard(self):
+        self._tar.close()
+        os.replace(self._tmp_path, os.path.join(self.shard_dir, self._name))
+        self.shards.append({'name': self._name, 'count': self._count, 'talks': self._talks})
+        self.retired.difference_update(self._talks)
+        self._write_index()
+        self._tar = None
+        if self.on_shard_closed:
+            self.on_shard_closed(list(self._talks))
+
+    def _write_index(self):
+        tmp_path = os.path.join(self.shard_dir, INDEX_FILE_NAME + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'shards': self.shards, 'retired': sorted(self.retired)}, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.shard_dir, INDEX_FILE_NAME))
+
+    def write(self, key, audio_bytes, audio_ext, label, meta=None, talk=None):
+        """ talk identifies the group the utterance belongs to; it is stored as meta['talk_id'] """
+        if self._tar is None:
+            self._open_shard()
+        if talk is not None:
+            meta = dict(meta or {}, talk_id=talk)
+            self._talks[talk] = self._talks.get(talk, 0) + 1
+        _add_member(self._tar, f'{key}.{audio_ext}', audio_bytes)
+        _add_member(self._tar, f'{key}.txt', label.encode('utf-8'))
+        _add_member(self._tar, f'{key}.json', json.dumps(meta or {}).encode('utf-8'))
+        self._count += 1
+        if self._tar.fileobj.tell() >= self.max_bytes:
+            self._close_shard()
+
+    def retire(self, talks):
+        """ Exclude every utterance of talks from readers """
+        self.retired.update(talks)
+        self._write_index()
+
+    def close(self):
+        if self._tar is not None:
+            self._close_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _load_index(shard_dir):
+    index_path = os.path.join(shard_dir, INDEX_FILE_NAME)
+    if not os.path.isfile(index_path):
+        return {'shards': []}
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def read_index(shard_dir):
+    """
+    List of {'name', 'count', 'talks', 'skip_talks'} entries for the completed shards in shard_dir.
+    skip_talks holds the talks of the shard that were retired or written again to a later shard.
+    """
+    index = _load_index(shard_dir)
+    shards = index['shards']
+    retired = set(index.get('retired', []))
+    latest = {}
+    for position, shard in enumerate(shards):
+        for talk in shard.get('talks', {}):
+            latest[talk] = position
+    for position, shard in enumerate(shards):
+        shard['skip_talks'] = {talk for talk in shard.get('talks', {}) if talk in retired or latest[talk] != position}
+    return shards
+
+
+def iter_shard(shard_path, skip_talks=()):
+    """
+    Read a shard sequentially and yield one dict per utterance:
+    {'key', 'audio' (bytes), 'audio_ext', 'label', 'meta'}
+    Utterances whose meta['talk_id'] is in skip_talks are left out.
+    """
+    def keep(sample):
+        return sample.get('meta', {}).get('talk_id') not in skip_talks
+
+    sample = None
+    with tarfile.open(shard_path, 'r|') as tar: # stream mode, no seeking
+        for member in tar:
+            key, _, ext = member.name.partition('.')
+            if sample is not None and sample['key'] != key:
+                if keep(sample):
+                    yield sample
+                sample = None
+            if sample is None:
+                sample = {'key': key}
+            data = tar.extractfile(member).read()
+            if ext == 'txt':
+                sample['label'] = data.decode('utf-8')
+            elif ext == 'json':
+                sample['meta'] = json.loads(data)
+            else:
+                sample['audio'] = data
+                sample['audio_ext'] = ext
+    if sample is not None and keep(sample):
+        yield sample
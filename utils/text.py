@@ -1,6 +1,6 @@
 import torch
-import num2words
-import re
+
+from utils import normalize
 
 class TextProcess:
 	def __init__(self):
@@ -42,6 +42,13 @@ class TextProcess:
 			self.index_map[int(index)] = ch
 		self.index_map[1] = ' '
 
+		# byte <-> id lookup tables for the batch APIs; -1 marks bytes outside the vocabulary
+		self.byte_to_id = torch.full((256,), -1, dtype=torch.long)
+		self.id_to_byte = torch.zeros(len(self.index_map), dtype=torch.uint8)
+		for index, ch in self.index_map.items():
+			self.byte_to_id[ord(ch)] = index
+			self.id_to_byte[index] = ord(ch)
+
 	def text_to_int_sequence(self, text):
 		""" Use a character map and convert text to an integer sequence """
 		int_sequence = []
@@ -60,23 +67,51 @@ class TextProcess:
 			string.append(self.index_map[i])
 		return ''.join(string).replace('<SPACE>', ' ')
 
+	def encode_batch(self, texts, errors='raise'):
+		"""
+		Encode a list of strings with one table lookup over all their bytes.
+		Return (ids, lengths): every sequence concatenated into one LongTensor, and the length of each.
+		Characters outside the vocabulary raise an OutOfVocabularyError naming all of them before anything
+		is returned, or are dropped with errors='ignore'.
+		"""
+		encoded = [text.encode('utf-8') for text in texts]
+		lengths = torch.tensor([len(b) for b in encoded], dtype=torch.long)
+		data = bytearray(b''.join(encoded))
+		data = torch.frombuffer(data, dtype=torch.uint8) if data else torch.zeros(0, dtype=torch.uint8)
+		ids = self.byte_to_id[data.long()]
+		oov = ids < 0
+		if oov.any():
+			if errors == 'raise':
+				vocabulary = set(self.index_map.values())
+				oov_chars = {i: sorted(set(text) - vocabulary) for i, text in enumerate(texts) if not set(text) <= vocabulary}
+				raise OutOfVocabularyError(oov_chars)
+			item_index = torch.repeat_interleave(torch.arange(len(texts)), lengths)
+			lengths = torch.bincount(item_index[~oov], minlength=len(texts))
+			ids = ids[~oov]
+		return ids, lengths
+
+	def decode_batch(self, ids, lengths=None):
+		"""
+		Decode a padded (batch, max_len) id tensor back to strings in one table lookup.
+		lengths gives the true length of each row; without it whole rows are decoded.
+		"""
+		ids = torch.as_tensor(ids, dtype=torch.long)
+		if ids.numel() and (ids.min() < 0 or ids.max() >= len(self.id_to_byte)):
+			raise ValueError(f"ids must be in [0, {len(self.id_to_byte)}), got values in [{int(ids.min())}, {int(ids.max())}]")
+		batch_size, width = ids.shape
+		text = self.id_to_byte[ids].numpy().tobytes().decode('ascii')
+		if lengths is None:
+			lengths = [width] * batch_size
+		return [text[i * width:i * width + int(length)] for i, length in enumerate(lengths)]
+
 	# methods to clean text
 	def clean_text(self, text):
-		text = text.lower()
-		text = self.remove_punctuations(text)
-		text = self.convert_year_to_words(text)
-		text = self.convert_num_to_words(text)
-		text = text.replace('-', ' ')
-		return text
-
-	def convert_year_to_words(self, text):
-	    text = ' '.join([num2words.num2words(i, to='year') if (i.isdigit() & (len(i) == 4)) else i for i in text.split()])
-	    return text
+		""" Same normalization as the preprocessing labels, see utils.normalize """
+		return normalize.clean_text(text)
 
-	def convert_num_to_words(self, text):
-	    text = ' '.join([num2words.num2words(i) if i.isdigit() else i for i in text.split()])
-	    return text
 
-	def remove_punctuations(self, text):
-		text = re.sub(r'[^\w\s]', ' ', text)
-		return text
\ No newline at end of file
+class OutOfVocabularyError(ValueError):
+	""" Raised by TextProcess.encode_batch; oov_chars maps the index of each offending text to its unknown characters """
+	def __init__(self, oov_chars):
+		self.oov_chars = oov_chars
+		super().__init__(f"Characters outside the vocabulary in {len(oov_chars)} texts: {oov_chars}")
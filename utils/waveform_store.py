@@ -0,0 +1,124 @@
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import torch
+
+from utils.manifest import load_array, pack_strings, swap_in_dir
+
+logger = logging.getLogger(__name__)
+
+SAMPLES_FILE_NAME = 'samples.i16'
+INT16_SCALE = 32768.0 # torchaudio's scale for 16 bit pcm
+
+
+def to_float(waveform):
+    """ int16 samples from the store -> float waveform in [-1, 1), as torchaudio.load returns them; other dtypes pass through """
+    if waveform.dtype == torch.int16:
+        return waveform.float() / INT16_SCALE
+    return waveform
+
+
+def manifest_fingerprint(manifest):
+    """ Hash of the audio paths and frame counts of a manifest, to tell whether a store was built from it """
+    digest = hashlib.sha1(np.ascontiguousarray(manifest.audio_blob).tobytes())
+    digest.update(np.ascontiguousarray(manifest.num_frames).tobytes())
+    return digest.hexdigest()
+
+
+def _to_int16(waveform):
+    samples = torch.round(waveform.reshape(-1) * INT16_SCALE).clamp_(-INT16_SCALE, INT16_SCALE - 1)
+    return samples.to(torch.int16).numpy()
+
+
+class WaveformStore:
+    """
+    Every waveform of a split, decoded once and packed back to back into one int16 file, plus an index of
+    (offset, length, label offset) per utterance and the labels as one utf-8 blob.
+    The samples file is memory-mapped, so items are zero-copy slices of it, and every DataLoader worker and
+    epoch reads the same pages from the OS page cache instead of decoding its own copy of each file.
+    Mappings are opened lazily in each process and are not pickled, so spawned workers map the file themselves.
+    Built in a temporary directory and swapped in like the manifest, see swap_in_dir: a store opened while
+    another process swaps in a rebuild may be missing for a moment, and is then built again. The arrays are
+    mapped on first access, so do not rebuild a store that open datasets still read.
+    """
+
+    ARRAYS = ('offsets', 'lengths', 'label_offsets', 'label_blob')
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.sample_rate = self.meta['sample_rate']
+        self._arrays = None
+
+    @classmethod
+    def build(cls, store_dir, manifest, load_waveform, sample_rate):
+        """
+        Decode every utterance of manifest with load_waveform(audio_path) -> (1, samples) float tensor at
+        sample_rate, and write them to store_dir.
+        """
+        tmp_dir = f'{store_dir}.{os.getpid()}.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+        offsets = np.zeros(len(manifest), dtype=np.int64)
+        lengths = np.zeros(len(manifest), dtype=np.int64)
+        offset = 0
+        with open(os.path.join(tmp_dir, SAMPLES_FILE_NAME), 'wb') as f:
+            for index in range(len(manifest)):
+                samples = _to_int16(load_waveform(manifest.audio_path(index)))
+                f.write(samples.tobytes())
+                offsets[index], lengths[index] = offset, len(samples)
+                offset += len(samples)
+        label_blob, label_offsets = pack_strings([manifest.label(index) for index in range(len(manifest))])
+        arrays = {'offsets': offsets, 'lengths': lengths, 'label_offsets': label_offsets, 'label_blob': label_blob}
+        for name in cls.ARRAYS:
+            np.save(os.path.join(tmp_dir, name + '.npy'), arrays[name])
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({'sample_rate': sample_rate, 'count': len(manifest), 'num_samples': offset,
+                       'manifest': manifest_fingerprint(manifest)}, f)
+        swap_in_dir(tmp_dir, store_dir)
+        logger.info(f'packed {len(manifest)} utterances, {offset * 2 / 1e6:.1f} MB, into {store_dir}')
+        return cls(store_dir)
+
+    @classmethod
+    def open(cls, store_dir, manifest, load_waveform, sample_rate, rebuild=False):
+        """ Open the store in store_dir, building it first if it is missing or was built for another rate or manifest """
+        if not rebuild and os.path.isfile(os.path.join(store_dir, 'meta.json')):
+            store = cls(store_dir)
+            if store.sample_rate == sample_rate and store.meta.get('manifest') == manifest_fingerprint(manifest):
+                return store
+            logger.info(f'{store_dir} does not match the dataset, rebuilding it')
+        return cls.build(store_dir, manifest, load_waveform, sample_rate)
+
+    def _open_arrays(self):
+        if self._arrays is None:
+            samples_path = os.path.join(self.store_dir, SAMPLES_FILE_NAME)
+            # copy-on-write mapping: pages are shared through the page cache until someone writes to a tensor
+            samples = np.memmap(samples_path, dtype=np.int16, mode='c') if self.meta['num_samples'] else np.zeros(0, np.int16)
+            arrays = {name: load_array(os.path.join(self.store_dir, name + '.npy')) for name in self.ARRAYS}
+            self._arrays = dict(arrays, samples=samples)
+        return self._arrays
+
+    def __getstate__(self):
+        return dict(self.__dict__, _arrays=None)
+
+    def __len__(self):
+        return self.meta['count']
+
+    @property
+    def lengths(self):
+        """ Sample count of every utterance """
+        return self._open_arrays()['lengths']
+
+    def waveform(self, index):
+        """ int16 samples of an utterance, as a tensor sharing memory with the mapped file """
+        arrays = self._open_arrays()
+        offset = arrays['offsets'][index]
+        return torch.from_numpy(arrays['samples'][offset:offset + arrays['lengths'][index]])
+
+    def label(self, index):
+        arrays = self._open_arrays()
+        start, end = arrays['label_offsets'][index], arrays['label_offsets'][index + 1]
+        return bytes(arrays['label_blob'][start:end]).decode('utf-8')